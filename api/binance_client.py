@@ -0,0 +1,187 @@
+"""
+Binance client used by the monitor.
+Thin subclass of python-binance Client with faster response parsing
+and an HTTP/2 keep-alive transport shared by all client instances.
+"""
+
+import threading
+from urllib.parse import urlencode
+
+import httpx
+import requests
+from binance.client import Client
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+try:
+    import orjson
+except ImportError:
+    # Fallback to stdlib json via requests if orjson is not installed
+    orjson = None
+
+try:
+    import h2  # noqa: F401 - required by httpx for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Transport-level errors from either HTTP backend
+TRANSPORT_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError)
+
+# Accounts and their endpoints are fetched concurrently; cap in-flight Binance requests
+# across all clients so a large account list does not burst into the IP weight limit
+MAX_CONCURRENT_REQUESTS = 10
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# One connection pool for every client in the process: accounts (and warm invocations)
+# reuse the open TLS connections to api.binance.com instead of handshaking per account
+MAX_KEEPALIVE_CONNECTIONS = 20
+# A hung or unreachable endpoint must not stall the whole cron run: connecting gets a short
+# budget of its own (the overall per-request timeout still applies to reads), and failed
+# connects are retried - safe for any method because nothing reached Binance yet
+CONNECT_TIMEOUT_SECONDS = 3.0
+CONNECT_RETRIES = 2
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_http_client():
+    """Return the process-wide httpx.Client, creating it on first use."""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = httpx.Client(
+                    transport=httpx.HTTPTransport(
+                        http2=HTTP2_AVAILABLE,
+                        limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+                        retries=CONNECT_RETRIES,
+                    ),
+                )
+    return _shared_client
+
+
+class HttpxSession:
+    """
+    requests.Session-compatible facade over httpx.Client.
+    python-binance only calls session.get/post/put/delete and close(),
+    so this is enough to move it onto a pooled HTTP/2 connection.
+    Headers (API key) and timeout stay per session; the connection pool is shared.
+    """
+
+    def __init__(self, headers=None, timeout=10.0):
+        self._client = get_shared_http_client()
+        self.headers = httpx.Headers(headers)
+        self.timeout = timeout
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None, **kwargs):
+        """Send a request using requests-style arguments."""
+        content = None
+        if data:
+            # python-binance passes form data as a list of tuples or a pre-encoded string
+            content = data if isinstance(data, (str, bytes)) else urlencode(data)
+
+        request_headers = self.headers.copy()
+        if headers:
+            request_headers.update(headers)
+
+        if isinstance(params, str):
+            # python-binance signs the pre-joined query string; passing it as params= would let httpx
+            # re-encode it (e.g. '@' -> '%40') and break the HMAC, so it goes on the URL verbatim
+            url = f"{url}{'&' if '?' in url else '?'}{params}"
+            params = None
+
+        timeout = timeout if timeout is not None else self.timeout
+        return self._client.request(
+            method.upper(),
+            url,
+            params=params,
+            content=content,
+            headers=request_headers,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, CONNECT_TIMEOUT_SECONDS)),
+        )
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        # The pool outlives any one client; just drop this session's reference to it
+        self._client = None
+
+
+class MonitorBinanceClient(Client):
+    """python-binance Client using a shared HTTP/2 keep-alive pool and orjson response parsing."""
+
+    def _init_session(self):
+        """Use the shared httpx pool (HTTP/2 when h2 is installed, HTTP/1.1 keep-alive otherwise)."""
+        return HttpxSession(headers=self._get_headers(), timeout=self.REQUEST_TIMEOUT)
+
+    def _request(self, method, uri, signed, force_params=False, **kwargs):
+        """
+        Same as Client._request of python-binance 1.0.37 (pinned in requirements.txt), but waits
+        for a free slot in the shared request limit.
+
+        One client is used from several threads (NAV wallets, deposit/withdrawal history), so the
+        response is parsed from a local variable - Client._request stores it in self.response and
+        parses that, letting concurrent calls read each other's body.
+        """
+        headers = {}
+        if method.upper() in ("POST", "PUT", "DELETE"):
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        if "data" in kwargs and "headers" in kwargs["data"]:
+            headers.update(kwargs["data"].pop("headers"))
+
+        kwargs = self._get_request_kwargs(method, signed, force_params, **kwargs)
+        data = kwargs.pop("data", None)
+
+        if signed and self.PRIVATE_KEY and data:
+            # Same eddsa/rsa signature handling as Client._request
+            dict_data = Client.convert_to_dict(data)
+            signature = dict_data.pop("signature", None)
+            data = f"{urlencode(dict_data)}&signature={signature}"
+
+        with _request_slots:
+            response = getattr(self.session, method)(uri, headers=headers, data=data, **kwargs)
+        # Kept only for code that inspects the last response; never read here
+        self.response = response
+
+        if self.verbose:
+            self.logger.debug(
+                "\nRequest: %s %s\nRequestHeaders: %s\nRequestBody: %s\nResponse: %s\nResponseHeaders: %s\nResponseBody: %s",
+                method.upper(),
+                uri,
+                headers,
+                data,
+                response.status_code,
+                dict(response.headers),
+                response.text[:1000] if response.text else None,
+            )
+
+        return self._handle_response(response)
+
+    @staticmethod
+    def _handle_response(response):
+        """Same contract as Client._handle_response, but decodes the raw body with orjson."""
+        if orjson is None:
+            return Client._handle_response(response)
+
+        if not (200 <= response.status_code < 300):
+            raise BinanceAPIException(response, response.status_code, response.text)
+
+        content = response.content
+        if not content:
+            return {}
+
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            raise BinanceRequestException("Invalid Response: %s" % response.text)
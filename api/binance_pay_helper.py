@@ -23,12 +23,16 @@ def create_signature(params: Dict[str, Any], secret: str) -> str:
     return signature
 
 
-def get_pay_transactions(api_key: str, api_secret: str, logger=None, account_id=None) -> List[Dict[str, Any]]:
+def get_pay_transactions(api_key: str, api_secret: str, logger=None, account_id=None,
+                         start_time: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Get Binance Pay transactions using direct API call.
     
     This is a workaround for python-binance bug with /sapi/v1/pay/transactions endpoint.
     
+    Args:
+        start_time: Optional start timestamp in milliseconds, filtered server-side
+    
     Returns:
         List of pay transaction dictionaries
     """
@@ -40,6 +44,8 @@ def get_pay_transactions(api_key: str, api_secret: str, logger=None, account_id=
         params = {
             'timestamp': int(time.time() * 1000)
         }
+        if start_time is not None:
+            params['startTime'] = int(start_time)
         
         # Add signature
         params['signature'] = create_signature(params, api_secret)
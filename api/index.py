@@ -1,18 +1,28 @@
 import os
+import re
 import sys
 import json
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import nullcontext
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from operator import itemgetter
 from datetime import datetime, timedelta, UTC
 from http.server import BaseHTTPRequestHandler
-from binance.client import Client as BinanceClient
+from urllib.parse import parse_qs, urlsplit
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+import httpx
+from postgrest import APIError, CountMethod, ReturnMethod
+from api.binance_client import MonitorBinanceClient as BinanceClient, TRANSPORT_ERRORS
 from api.binance_pay_helper import get_pay_transactions
 from api.sub_account_helper import get_sub_account_transfers, normalize_sub_account_transfers
 
 # Debug print removed - was causing issues on Vercel
 
 # Use absolute imports for better Vercel compatibility
-from api.logger import get_logger, LogCategory, OperationTimer
+from api.logger import get_logger, LogCategory, LogLevel, OperationTimer
 
 # Add project root to path for config import
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
@@ -33,6 +43,7 @@ try:
     if not hasattr(settings, 'scheduling'):
         class Scheduling:
             historical_period_days = 30
+            min_poll_interval_seconds = 15
         settings.scheduling = Scheduling()
 except (ValueError, ImportError, ModuleNotFoundError) as e:
     # Create minimal settings for Vercel environment
@@ -51,6 +62,7 @@ except (ValueError, ImportError, ModuleNotFoundError) as e:
             minimum_usd_value_threshold = 0.1
         class Scheduling:
             historical_period_days = 30
+            min_poll_interval_seconds = 15
         
         def get_supported_symbols(self):
             """Method to get supported symbols for compatibility"""
@@ -70,6 +82,94 @@ except (ValueError, ImportError, ModuleNotFoundError) as e:
 from utils.log_cleanup import run_log_cleanup
 from utils.database_manager import get_supabase_client, with_database_retry
 
+# Settings are loaded once per process, so the stablecoin list is too (O(1) membership in NAV loops)
+SUPPORTED_STABLECOINS = frozenset(settings.get_supported_stablecoins())
+
+# Errors that mean "no price for this symbol" rather than a bug
+PRICE_LOOKUP_ERRORS = (BinanceAPIException, BinanceRequestException, *TRANSPORT_ERRORS,
+                       KeyError, ValueError, TypeError)
+
+# Funding wallet balance components summed into the asset total
+# (missing fields count as 0 - Binance omits some of them for certain assets)
+FUNDING_BALANCE_FIELDS = ('free', 'locked', 'freeze', 'withdrawing')
+
+# Transaction types stored in processed_transactions
+DEPOSIT_TYPES = frozenset({'DEPOSIT', 'PAY_DEPOSIT', 'SUB_DEPOSIT'})
+WITHDRAWAL_TYPES = frozenset({'WITHDRAWAL', 'PAY_WITHDRAWAL', 'FEE_WITHDRAWAL', 'SUB_WITHDRAWAL'})
+VALID_TRANSACTION_TYPES = DEPOSIT_TYPES | WITHDRAWAL_TYPES
+# Crypto deposits carry a USD valuation in metadata (PAY deposits are already in USD)
+CRYPTO_DEPOSIT_TYPES = frozenset({'DEPOSIT', 'SUB_DEPOSIT'})
+# Binance final-success statuses differ per endpoint: deposit 1 = Success,
+# withdrawal 6 = Completed (withdrawal 1 = Cancelled, so the codes must not be mixed)
+DEPOSIT_SUCCESS_STATUS = 1
+WITHDRAWAL_COMPLETED_STATUS = 6
+# Withdrawal info/description keywords marking a fee withdrawal
+FEE_INDICATOR_RE = re.compile(r'fee|management|performance|commission', re.IGNORECASE)
+
+# PostgREST rejected the request, or the HTTP call itself failed
+DB_WRITE_ERRORS = (APIError, httpx.HTTPError)
+# PostgREST: function not found in the schema cache (migration not applied, HTTP 404)
+MISSING_RPC_ERROR_CODE = 'PGRST202'
+
+# Net cashflow below this (USD) is a no-op: transactions are only recorded, the benchmark is not touched
+MIN_CASHFLOW_USD = 0.01
+
+# UNIQUE(account_id, transaction_id) - duplicates are skipped by Postgres instead of raising
+PROCESSED_TRANSACTIONS_CONFLICT = 'account_id,transaction_id'
+
+# Upper bound for rows per processed_transactions upsert in the non-RPC fallbacks
+PROCESSED_TRANSACTIONS_BATCH_SIZE = 1000
+# IDs per in_() dedup lookup - the filter goes into the GET query string, keep the URL short
+PROCESSED_ID_LOOKUP_BATCH_SIZE = 100
+
+# account_id -> (last_processed_timestamp, monotonic fetch time); written through on update.
+# Short TTL so resets done by admin tools / scripts are picked up quickly.
+_last_processed_cache = {}
+LAST_PROCESSED_CACHE_TTL_SECONDS = 300
+
+# account_id -> (transaction IDs known to be in processed_transactions, monotonic start time).
+# Survives warm invocations / daemon loops so a tick with nothing new skips the DB lookup.
+# IDs are kept in insertion order (dict keys) and capped to the most recent ones per account;
+# the whole entry expires with the same TTL, so rows deleted for reprocessing are noticed.
+_processed_id_cache = {}
+PROCESSED_ID_CACHE_MAX_PER_ACCOUNT = 500
+
+# symbol -> (price, monotonic fetch time) for single-ticker lookups, shared by all accounts.
+# Only used when the batched /ticker/price map is unavailable; the TTL keeps prices within one tick.
+_ticker_price_cache = {}
+TICKER_PRICE_CACHE_TTL_SECONDS = 30
+
+# Columns read by process_single_account / process_account_transfers; keep in sync when using new ones
+ACCOUNT_COLUMNS = 'id, account_name, api_key, api_secret, email, is_sub_account, master_api_key, master_api_secret'
+BENCHMARK_CONFIG_COLUMNS = ('account_id, btc_units, eth_units, rebalance_day, rebalance_hour, '
+                            'next_rebalance_timestamp, initialized_at, rebalance_count')
+
+# Accounts are I/O bound (Binance + Supabase round-trips), so they are processed concurrently
+MAX_ACCOUNT_WORKERS = 8
+
+
+@dataclass(slots=True)
+class Txn:
+    """Deposit/withdrawal parsed once from fetch_new_transactions output."""
+    id: str
+    type: str
+    status: str
+    amount: float
+    timestamp: str
+    metadata: dict | None = None
+
+    @classmethod
+    def from_dict(cls, raw):
+        return cls(
+            id=raw['id'],
+            type=raw.get('type') or '',
+            status=raw.get('status'),
+            amount=float(raw.get('amount') or 0),
+            timestamp=raw['timestamp'],
+            metadata=raw.get('metadata'),
+        )
+
+
 # --- Global clients ---
 try:
     supabase = get_supabase_client()
@@ -78,8 +178,26 @@ except Exception as e:
     # Traceback suppressed for Vercel
     supabase = None
 
+# Fixed response bodies, encoded once at import
+OK_BODY = b'Monitoring process completed successfully.'
+DB_INIT_ERROR_BODY = b'Error: Database connection failed during initialization'
+WARM_BODY = b'Warm.'
+
 # --- Main handler for Vercel ---
 class handler(BaseHTTPRequestHandler):
+    def _send_text(self, status, body=b''):
+        """Send a text/plain response; headers go out in one buffered write with end_headers()."""
+        self.send_response(status)
+        self.send_header('Content-type','text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        # Liveness probe: answers without touching the DB or running a monitoring cycle
+        self._send_text(200 if supabase is not None else 500)
+
     def do_GET(self):
         # Health check endpoint
         if self.path == '/api/health':
@@ -100,30 +218,30 @@ class handler(BaseHTTPRequestHandler):
             
         # Early error check
         if supabase is None:
-            self.send_response(500)
-            self.send_header('Content-type','text/plain')
-            self.end_headers()
-            self.wfile.write('Error: Database connection failed during initialization'.encode('utf-8'))
+            self._send_text(500, DB_INIT_ERROR_BODY)
+            return
+        
+        # Keep-warm ping (?warm=1): imports are done, open the pooled connections, no monitoring cycle
+        if 'warm' in parse_qs(urlsplit(self.path).query):
+            try:
+                warm_connections()
+                self._send_text(200, WARM_BODY)
+            except Exception as e:
+                self._send_text(500, f'Error: {e}'.encode('utf-8'))
             return
             
         try:
             logger = get_logger()
             logger.info(LogCategory.SYSTEM, "cron_trigger", "Cron job triggered - starting monitoring process")
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type','text/plain')
-            self.end_headers()
-            self.wfile.write(('Logger initialization error: ' + str(e)).encode('utf-8'))
+            self._send_text(500, ('Logger initialization error: ' + str(e)).encode('utf-8'))
             return
         
         try:
             with OperationTimer(logger, LogCategory.SYSTEM, "full_monitoring_cycle"):
                 process_all_accounts()
             
-            self.send_response(200)
-            self.send_header('Content-type','text/plain')
-            self.end_headers()
-            self.wfile.write('Monitoring process completed successfully.'.encode('utf-8'))
+            self._send_text(200, OK_BODY)
             
             logger.info(LogCategory.SYSTEM, "cron_complete", "Monitoring process completed successfully")
             
@@ -131,21 +249,24 @@ class handler(BaseHTTPRequestHandler):
             logger.error(LogCategory.SYSTEM, "cron_error", f"Main process failed: {str(e)}", error=str(e))
             # Traceback suppressed for Vercel
             
-            self.send_response(500)
-            self.send_header('Content-type','text/plain')
-            self.end_headers()
-            self.wfile.write(f'Error: {e}'.encode('utf-8'))
+            self._send_text(500, f'Error: {e}'.encode('utf-8'))
         return
 
 # --- Helper functions ---
+def warm_connections():
+    """Open the shared Binance and Supabase connection pools so the next cron run skips the handshakes."""
+    BinanceClient('', '')  # the constructor ping connects to api.binance.com through the shared pool
+    supabase.table('system_metadata').select('key').limit(1).execute()
+
 def ensure_benchmark_configs():
     """Ensure all accounts have benchmark configs, create missing ones."""
     logger = get_logger()
-    db_client = get_supabase_client()
+    # Module client: get_supabase_client() would add a health-check query on warm invocations
+    db_client = supabase
     
     try:
         # Get all accounts
-        accounts_response = db_client.table('binance_accounts').select('*').execute()
+        accounts_response = db_client.table('binance_accounts').select('id, account_name').execute()
         if not accounts_response.data:
             logger.warning(LogCategory.SYSTEM, "no_accounts_for_config", 
                           "No accounts found for benchmark config check")
@@ -210,7 +331,9 @@ def process_all_accounts():
         # Use real Supabase client
         db_client = supabase
         
-        response = db_client.table('binance_accounts').select('*, benchmark_configs(*)').execute()
+        response = db_client.table('binance_accounts').select(
+            f'{ACCOUNT_COLUMNS}, benchmark_configs({BENCHMARK_CONFIG_COLUMNS})'
+        ).execute()
     
     if not response.data:
         logger.warning(LogCategory.SYSTEM, "no_accounts", "No accounts found in database")
@@ -222,7 +345,6 @@ def process_all_accounts():
     logger.info(LogCategory.PRICE_UPDATE, "fetch_prices_once", "Fetching prices once for all accounts")
     try:
         # Create temporary Binance client just for price fetching
-        from binance.client import Client as BinanceClient
         temp_client = BinanceClient('', '')  # Use data API for read-only access
         # ALWAYS force data API URL for price fetching - no fallback needed
         temp_client.API_URL = 'https://data-api.binance.vision/api'
@@ -231,7 +353,9 @@ def process_all_accounts():
                    f"Created temp client with data API URL: {temp_client.API_URL}")
         
         with OperationTimer(logger, LogCategory.PRICE_UPDATE, "fetch_prices_all_accounts"):
-            prices = get_prices(temp_client, logger)
+            # One /ticker/price call prices every asset for every account in this run
+            tickers = get_ticker_prices(temp_client, logger)
+            prices = get_prices(temp_client, logger, tickers=tickers)
         
         if not prices:
             logger.error(LogCategory.PRICE_UPDATE, "price_fetch_failed", "Failed to fetch prices for all accounts")
@@ -245,7 +369,14 @@ def process_all_accounts():
                     f"Error fetching prices: {str(e)}", error=str(e))
         return
     
-    for account in response.data:
+    # Rebalance and NAV history writes are collected here and flushed once after all accounts
+    pending_config_updates = []
+    pending_history = []
+    pending_nav_history = []
+    # One timestamp for the whole tick so rows written for the same run line up
+    tick_ts = datetime.now(UTC)
+    
+    def run_account(account):
         account_name = account.get('account_name', 'Unknown')
         account_id = account.get('id')
         
@@ -256,7 +387,8 @@ def process_all_accounts():
         try:
             with OperationTimer(logger, LogCategory.ACCOUNT_PROCESSING, "process_account", 
                               account_id, account_name):
-                process_single_account(account, prices)
+                process_single_account(account, prices, pending_config_updates, pending_history,
+                                       pending_nav_history, tick_ts=tick_ts, tickers=tickers)
                 
             logger.info(LogCategory.ACCOUNT_PROCESSING, "complete_processing", 
                        f"Successfully processed account: {account_name}",
@@ -268,6 +400,16 @@ def process_all_accounts():
                         account_id=account_id, account_name=account_name, error=str(e))
             # Traceback suppressed for Vercel
     
+    # NAV fetch dominates each account, so accounts run in parallel (shared prices/tickers are read-only)
+    with ThreadPoolExecutor(max_workers=min(MAX_ACCOUNT_WORKERS, len(response.data))) as executor:
+        list(executor.map(run_account, response.data))
+    
+    save_nav_history_rows(db_client, pending_nav_history, logger)
+    # History only for accounts whose rebalanced config was saved - the rest rebalance again next run
+    saved_accounts = flush_benchmark_config_updates(db_client, pending_config_updates, logger)
+    save_rebalance_history(db_client, [row for row in pending_history if row['account_id'] in saved_accounts],
+                           logger)
+    
     # Run log cleanup after processing all accounts
     try:
         run_log_cleanup()
@@ -300,7 +442,7 @@ def process_account_transfers(db_client, account, binance_client, prices, logger
         # The API endpoint /sapi/v1/sub-account/transfer/subUserHistory works from MASTER account perspective
         if account.get('is_sub_account') and account.get('master_api_key') and account.get('master_api_secret'):
             # Use master credentials for sub-account
-            transfer_client = BinanceClient(account['master_api_key'], account['master_api_secret'])
+            transfer_client = BinanceClient(account['master_api_key'], account['master_api_secret'], ping=False)
             logger.info(LogCategory.TRANSACTION, "using_master_credentials",
                        f"Using master credentials for sub-account {account_name} transfer detection",
                        account_id=account_id)
@@ -315,7 +457,7 @@ def process_account_transfers(db_client, account, binance_client, prices, logger
         
         start_time = None
         if last_result.data:
-            last_timestamp = datetime.fromisoformat(last_result.data[0]['timestamp'].replace('Z', '+00:00'))
+            last_timestamp = datetime.fromisoformat(last_result.data[0]['timestamp'])
             start_time = int((last_timestamp + timedelta(minutes=1)).timestamp() * 1000)
         else:
             # Default to 30 days ago if no previous transfers
@@ -427,7 +569,7 @@ def process_account_transfers(db_client, account, binance_client, prices, logger
                         total_net_flow -= amount
             
             # Adjust benchmark if there's net cashflow
-            if total_net_flow != 0:
+            if abs(total_net_flow) >= MIN_CASHFLOW_USD:
                 logger.info(LogCategory.TRANSACTION, "sub_cashflow_detected",
                            f"SUB transfer net cashflow: ${total_net_flow:+,.2f}",
                            account_id=account_id)
@@ -456,9 +598,11 @@ def process_account_transfers(db_client, account, binance_client, prices, logger
     
     return config
 
-def process_single_account(account, prices=None):
+def process_single_account(account, prices=None, pending_config_updates=None, pending_history=None,
+                           pending_nav_history=None, tick_ts=None, tickers=None):
     """Kompletní logika pro jeden Binance účet."""
     logger = get_logger()
+    tick_ts = tick_ts or datetime.now(UTC)
     
     api_key = account.get('api_key')
     api_secret = account.get('api_secret')
@@ -476,9 +620,16 @@ def process_single_account(account, prices=None):
                     account_id=account_id, account_name=account_name)
         return
 
+    # PostgREST returns whole numeric values as int (or str for huge ones); coerce the units once
+    # so calculate_benchmark_value and the cashflow/rebalance math stay on plain floats
+    for units_key in ('btc_units', 'eth_units'):
+        if config.get(units_key) is not None:
+            config[units_key] = float(config[units_key])
+
     # Use real Binance client for authenticated endpoints
     tld = getattr(settings.api.binance, 'tld', 'com') if hasattr(settings, 'api') else 'com'
-    binance_client = BinanceClient(api_key, api_secret, tld=tld)
+    # No constructor ping: the price client in process_all_accounts already opened the shared pool
+    binance_client = BinanceClient(api_key, api_secret, tld=tld, ping=False)
     # Log which API URL is being used for this client
     logger.info(LogCategory.API_CALL, "binance_client_created", 
                f"Created Binance client for account {account_name}. API URL: {binance_client.API_URL}",
@@ -510,7 +661,7 @@ def process_single_account(account, prices=None):
         save_price_history(prices, logger)
 
     with OperationTimer(logger, LogCategory.API_CALL, "fetch_nav", account_id, account_name):
-        nav = get_comprehensive_nav(binance_client, logger, account_id, account_name, prices)
+        nav = get_comprehensive_nav(binance_client, logger, account_id, account_name, prices, tickers)
     if nav is None:
         return
 
@@ -531,30 +682,32 @@ def process_single_account(account, prices=None):
             config = initialize_benchmark(db_client, config, account_id, nav, prices, logger)
 
     # Zpracování vkladů a výběrů
-    config = process_deposits_withdrawals(db_client, binance_client, account_id, config, prices, logger)
+    config = process_deposits_withdrawals(db_client, binance_client, account_id, config, prices, logger,
+                                          tick_ts=tick_ts)
     
     # Process sub-account transfers with current config
     updated_config = process_account_transfers(db_client, account, binance_client, prices, logger, config)
     if updated_config:
         config = updated_config
 
-    # Kontrola a provedení rebalance
-    now_utc = datetime.now(UTC)
+    # Kontrola a provedení rebalance (against the tick time shared by all accounts)
     next_rebalance_str = config.get('next_rebalance_timestamp')
     if next_rebalance_str:
-        # Properly parse ISO timestamp with timezone
-        clean_timestamp = next_rebalance_str.replace('Z', '+00:00')
-        next_rebalance_dt = datetime.fromisoformat(clean_timestamp)
-        if now_utc >= next_rebalance_dt:
+        # fromisoformat parses the 'Z' suffix natively on Python 3.11+
+        next_rebalance_dt = datetime.fromisoformat(next_rebalance_str)
+        if tick_ts >= next_rebalance_dt:
             logger.info(LogCategory.REBALANCING, "rebalance_time", 
                        "Rebalance time reached, starting rebalancing",
                        account_id=account_id, account_name=account_name)
             # Use current benchmark value to maintain independence from portfolio NAV
             current_benchmark_value = calculate_benchmark_value(config, prices)
-            config = rebalance_benchmark(db_client, config, account_id, current_benchmark_value, prices, logger)
+            config = rebalance_benchmark(db_client, config, account_id, current_benchmark_value, prices, logger,
+                                         pending_updates=pending_config_updates,
+                                         pending_history=pending_history)
 
     benchmark_value = calculate_benchmark_value(config, prices)
-    save_history(db_client, account_id, nav, benchmark_value, logger, account_name, prices)
+    save_history(db_client, account_id, nav, benchmark_value, logger, account_name, prices,
+                 pending_rows=pending_nav_history, timestamp=tick_ts)
 
 # --- Helper functions ---
 
@@ -568,7 +721,7 @@ def get_coin_usd_value(client, coin, amount, btc_usd_price=None, logger=None, ac
         return (0.0, None, None)
     
     # Check if it's a stablecoin
-    if coin in settings.get_supported_stablecoins():
+    if coin in SUPPORTED_STABLECOINS:
         return (amount, 1.0, 'stablecoin')
     
     # Try direct USDT pair first
@@ -616,7 +769,22 @@ def get_coin_usd_value(client, coin, amount, btc_usd_price=None, logger=None, ac
     
     return (None, None, None)
 
-def get_prices(client, logger=None, account_id=None, account_name=None):
+def get_ticker_prices(client, logger=None):
+    """
+    Vrátí {symbol: cena} pro všechny páry z jednoho /ticker/price volání.
+    Sdílí se všemi účty v jednom běhu místo ticker requestu pro každý asset.
+    Při chybě vrací None a volající se vrátí k jednotlivým ticker voláním.
+    """
+    try:
+        return {t['symbol']: float(t['price']) for t in client.get_all_tickers()}
+    except PRICE_LOOKUP_ERRORS as e:
+        if logger:
+            logger.warning(LogCategory.PRICE_UPDATE, "all_tickers_error",
+                           f"Failed to fetch all ticker prices, falling back to per-symbol calls: {str(e)}",
+                           error=str(e))
+        return None
+
+def get_prices(client, logger=None, account_id=None, account_name=None, tickers=None):
     try:
         # ALWAYS force data API for price queries to bypass geographic restrictions
         data_api_url = 'https://data-api.binance.vision/api'
@@ -642,8 +810,11 @@ def get_prices(client, logger=None, account_id=None, account_name=None):
                         f"Fetching prices for symbols: {supported_symbols}")
             
         for symbol in supported_symbols:
-            ticker = client.get_symbol_ticker(symbol=symbol)
-            prices[symbol] = float(ticker['price'])
+            if tickers and symbol in tickers:
+                prices[symbol] = tickers[symbol]
+            else:
+                ticker = client.get_symbol_ticker(symbol=symbol)
+                prices[symbol] = float(ticker['price'])
         
         # Keep using data API URL - do not restore original
             
@@ -732,7 +903,55 @@ def save_price_history(prices, logger=None):
             logger.error(LogCategory.PRICE_UPDATE, "price_history_error", 
                         f"Failed to save price history: {str(e)}", error=str(e))
 
-def get_comprehensive_nav(client, logger=None, account_id=None, account_name=None, prices=None):
+def get_symbol_price(client, symbol):
+    """
+    Cena jednoho symbolu přes /ticker/price?symbol=..., s krátkou TTL cache,
+    takže stejný asset na více účtech v jednom běhu stojí jen jedno volání.
+    Chyby se necachují a propagují se volajícímu.
+    """
+    cached = _ticker_price_cache.get(symbol)
+    if cached and time.monotonic() - cached[1] < TICKER_PRICE_CACHE_TTL_SECONDS:
+        return cached[0]
+    
+    price = float(client.get_symbol_ticker(symbol=symbol)['price'])
+    _ticker_price_cache[symbol] = (price, time.monotonic())
+    return price
+
+def get_asset_usd_price(client, asset, btc_usd_price, stablecoins, via_btc=True, tickers=None):
+    """
+    Vrátí USD cenu jedné jednotky assetu pro výpočet NAV.
+    Stablecoiny a BTC se vyřeší bez API volání, jinak {asset}USDT ticker
+    a volitelně fallback přes {asset}BTC. Pokud cenu nelze zjistit, vrací 0.0.
+    S předaným tickers mapováním (get_ticker_prices) se nevolá API vůbec.
+    """
+    if asset in stablecoins:
+        return 1.0
+    if asset == 'BTC':
+        return btc_usd_price
+    
+    if tickers is not None:
+        price = tickers.get(f"{asset}USDT")
+        if price is not None:
+            return price
+        if via_btc:
+            btc_price = tickers.get(f"{asset}BTC")
+            if btc_price is not None:
+                return btc_price * btc_usd_price
+        return 0.0
+    
+    try:
+        return get_symbol_price(client, f"{asset}USDT")
+    except PRICE_LOOKUP_ERRORS:
+        if not via_btc:
+            return 0.0
+    
+    try:
+        # Zkus přes BTC pak na USDT
+        return get_symbol_price(client, f"{asset}BTC") * btc_usd_price
+    except PRICE_LOOKUP_ERRORS:
+        return 0.0  # Nelze určit cenu
+
+def get_comprehensive_nav(client, logger=None, account_id=None, account_name=None, prices=None, tickers=None):
     """
     Vypočítá kompletní NAV zahrnující:
     1. Spot účet - všechny balances převedené na USD
@@ -746,13 +965,29 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         # Use provided prices or fetch BTC price for conversions
         if prices and 'BTCUSDT' in prices:
             btc_usd_price = float(prices['BTCUSDT'])
+        elif tickers and 'BTCUSDT' in tickers:
+            btc_usd_price = tickers['BTCUSDT']
         else:
             # Fallback to fetching if prices not provided
-            btc_ticker = client.get_symbol_ticker(symbol="BTCUSDT")
-            btc_usd_price = float(btc_ticker['price'])
+            btc_usd_price = get_symbol_price(client, "BTCUSDT")
+        
+        stablecoins = SUPPORTED_STABLECOINS
+        # Thresholds read once per NAV fetch instead of per balance
+        min_balance = settings.financial.minimum_balance_threshold
+        min_usd_value = settings.financial.minimum_usd_value_threshold
+        
+        # The five wallet endpoints are independent, so fetch them concurrently.
+        # Spot/futures errors still fail the NAV; the optional wallets only log a warning.
+        # Sharing one client is safe: MonitorBinanceClient._request parses its own local response.
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            spot_future = executor.submit(client.get_account)
+            futures_future = executor.submit(client.futures_account)
+            funding_future = executor.submit(client.funding_wallet, needBtcValuation='true')
+            earn_future = executor.submit(client._request, 'GET', 'sapi/v1/simple-earn/flexible/position', True, {})
+            staking_future = executor.submit(client.get_staking_position, product='STAKING')
         
         # 1. SPOT ACCOUNT - všechny balances
-        spot_account = client.get_account()
+        spot_account = spot_future.result()
         spot_total = 0.0
         spot_details = {}
         
@@ -762,28 +997,11 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
             locked = float(balance['locked'])
             total_balance = free + locked
             
-            if total_balance > settings.financial.minimum_balance_threshold:  # Ignoruj velmi malé balances
+            if total_balance > min_balance:  # Ignoruj velmi malé balances
                 # Převeď na USD hodnotu
-                if asset in settings.get_supported_stablecoins():
-                    usdt_value = total_balance
-                elif asset == 'BTC':
-                    usdt_value = total_balance * btc_usd_price
-                else:
-                    try:
-                        # Získej cenu vůči USDT
-                        ticker = client.get_symbol_ticker(symbol=f"{asset}USDT")
-                        price = float(ticker['price'])
-                        usdt_value = total_balance * price
-                    except:
-                        try:
-                            # Zkus přes BTC pak na USDT
-                            btc_ticker_asset = client.get_symbol_ticker(symbol=f"{asset}BTC")
-                            btc_price = float(btc_ticker_asset['price'])
-                            usdt_value = total_balance * btc_price * btc_usd_price
-                        except:
-                            usdt_value = 0.0  # Nelze určit cenu
+                usdt_value = total_balance * get_asset_usd_price(client, asset, btc_usd_price, stablecoins, tickers=tickers)
                 
-                if usdt_value > settings.financial.minimum_usd_value_threshold:  # Ignoruj hodnoty pod $0.1
+                if usdt_value > min_usd_value:  # Ignoruj hodnoty pod $0.1
                     spot_total += usdt_value
                     spot_details[asset] = {
                         'balance': total_balance,
@@ -794,7 +1012,7 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         breakdown['spot_details'] = spot_details
         
         # 2. FUTURES ACCOUNT - MARGIN BALANCE (wallet + unrealized P&L)
-        futures_account = client.futures_account()
+        futures_account = futures_future.result()
         futures_total = 0.0
         futures_details = {}
         
@@ -804,19 +1022,9 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
             unrealized_pnl = float(asset_info['unrealizedProfit'])
             margin_balance = float(asset_info['marginBalance'])  # wallet + unrealized
             
-            if abs(margin_balance) > settings.financial.minimum_balance_threshold:  # Používáme marginBalance místo walletBalance
+            if abs(margin_balance) > min_balance:  # Používáme marginBalance místo walletBalance
                 # Převeď na USD
-                if asset in settings.get_supported_stablecoins():
-                    usd_value = margin_balance
-                elif asset == 'BTC':
-                    usd_value = margin_balance * btc_usd_price
-                else:
-                    try:
-                        ticker = client.get_symbol_ticker(symbol=f"{asset}USDT")
-                        price = float(ticker['price'])
-                        usd_value = margin_balance * price
-                    except:
-                        usd_value = 0.0
+                usd_value = margin_balance * get_asset_usd_price(client, asset, btc_usd_price, stablecoins, via_btc=False, tickers=tickers)
                 
                 futures_total += usd_value
                 futures_details[asset] = {
@@ -833,35 +1041,21 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         funding_total = 0.0
         funding_details = {}
         try:
-            funding_assets = client.funding_wallet()
+            funding_assets = funding_future.result()
             for asset_info in funding_assets:
                 asset = asset_info.get('asset', '')
-                free = float(asset_info.get('free', '0'))
-                locked = float(asset_info.get('locked', '0'))
-                freeze = float(asset_info.get('freeze', '0'))
-                withdrawing = float(asset_info.get('withdrawing', '0'))
-                total_balance = free + locked + freeze + withdrawing
+                total_balance = sum(float(asset_info.get(field) or 0) for field in FUNDING_BALANCE_FIELDS)
+                
+                # Binance už asset ocenil v BTC - prach přeskočíme bez volání tickeru
+                btc_valuation = asset_info.get('btcValuation')
+                if btc_valuation is not None and float(btc_valuation) * btc_usd_price <= min_usd_value:
+                    continue
                 
-                if total_balance > settings.financial.minimum_balance_threshold:
+                if total_balance > min_balance:
                     # Převeď na USD
-                    if asset in settings.get_supported_stablecoins():
-                        usd_value = total_balance
-                    elif asset == 'BTC':
-                        usd_value = total_balance * btc_usd_price
-                    else:
-                        try:
-                            ticker = client.get_symbol_ticker(symbol=f"{asset}USDT")
-                            price = float(ticker['price'])
-                            usd_value = total_balance * price
-                        except:
-                            try:
-                                btc_ticker_asset = client.get_symbol_ticker(symbol=f"{asset}BTC")
-                                btc_price = float(btc_ticker_asset['price'])
-                                usd_value = total_balance * btc_price * btc_usd_price
-                            except:
-                                usd_value = 0.0
+                    usd_value = total_balance * get_asset_usd_price(client, asset, btc_usd_price, stablecoins, tickers=tickers)
                     
-                    if usd_value > settings.financial.minimum_usd_value_threshold:
+                    if usd_value > min_usd_value:
                         funding_total += usd_value
                         funding_details[asset] = {
                             'balance': total_balance,
@@ -881,7 +1075,7 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         earn_details = {}
         try:
             # Zkus Simple Earn flexible positions
-            response = client._request('GET', 'sapi/v1/simple-earn/flexible/position', True, {})
+            response = earn_future.result()
             
             # Handle different response structures
             positions = []
@@ -897,21 +1091,11 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
                     asset = position.get('asset', '')
                     total_amount = float(position.get('totalAmount', '0'))
                     
-                    if total_amount > settings.financial.minimum_balance_threshold:
+                    if total_amount > min_balance:
                         # Převeď na USD
-                        if asset in settings.get_supported_stablecoins():
-                            usd_value = total_amount
-                        elif asset == 'BTC':
-                            usd_value = total_amount * btc_usd_price
-                        else:
-                            try:
-                                ticker = client.get_symbol_ticker(symbol=f"{asset}USDT")
-                                price = float(ticker['price'])
-                                usd_value = total_amount * price
-                            except:
-                                usd_value = 0.0
+                        usd_value = total_amount * get_asset_usd_price(client, asset, btc_usd_price, stablecoins, via_btc=False, tickers=tickers)
                         
-                        if usd_value > settings.financial.minimum_usd_value_threshold:
+                        if usd_value > min_usd_value:
                             earn_total += usd_value
                             earn_details[f"{asset}_flexible"] = {
                                 'balance': total_amount,
@@ -930,26 +1114,16 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         staking_total = 0.0
         staking_details = {}
         try:
-            staking_positions = client.get_staking_position(product='STAKING')
+            staking_positions = staking_future.result()
             for position in staking_positions:
                 asset = position.get('asset', '')
                 amount = float(position.get('amount', '0'))
                 
-                if amount > settings.financial.minimum_balance_threshold:
+                if amount > min_balance:
                     # Převeď na USD
-                    if asset in settings.get_supported_stablecoins():
-                        usd_value = amount
-                    elif asset == 'BTC':
-                        usd_value = amount * btc_usd_price
-                    else:
-                        try:
-                            ticker = client.get_symbol_ticker(symbol=f"{asset}USDT")
-                            price = float(ticker['price'])
-                            usd_value = amount * price
-                        except:
-                            usd_value = 0.0
+                    usd_value = amount * get_asset_usd_price(client, asset, btc_usd_price, stablecoins, via_btc=False, tickers=tickers)
                     
-                    if usd_value > settings.financial.minimum_usd_value_threshold:
+                    if usd_value > min_usd_value:
                         staking_total += usd_value
                         staking_details[asset] = {
                             'balance': amount,
@@ -969,7 +1143,7 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         breakdown['total_nav'] = total_nav
         breakdown['btc_usd_price'] = btc_usd_price
         
-        if logger:
+        if logger and logger.is_enabled(LogLevel.INFO):
             wallet_breakdown = f"Spot: ${spot_total:.2f}, Futures: ${futures_total:.2f}"
             if funding_total > 0:
                 wallet_breakdown += f", Funding: ${funding_total:.2f}"
@@ -993,7 +1167,7 @@ def get_comprehensive_nav(client, logger=None, account_id=None, account_name=Non
         # Error getting comprehensive NAV
         return None
 
-def get_universal_nav(client, logger=None, account_id=None, account_name=None, prices=None):
+def get_universal_nav(client, logger=None, account_id=None, account_name=None, prices=None, tickers=None):
     """
     Získá NAV ze všech typů peněženek pomocí univerzálního SAPI endpointu.
     Vyžaduje API klíč s oprávněním 'Permits Universal Transfer'.
@@ -1046,7 +1220,7 @@ def get_universal_nav(client, logger=None, account_id=None, account_name=None, p
                           account_id=account_id, account_name=account_name, error=str(e))
         
         # Použij stávající comprehensive NAV jako fallback
-        return get_comprehensive_nav(client, logger, account_id, account_name, prices)
+        return get_comprehensive_nav(client, logger, account_id, account_name, prices, tickers)
 
 def get_futures_account_nav(client, logger=None, account_id=None, account_name=None):
     """Starý způsob výpočtu NAV - zachován pro kompatibilitu"""
@@ -1069,20 +1243,27 @@ def get_futures_account_nav(client, logger=None, account_id=None, account_name=N
         # Error getting NAV
         return None
 
-def calculate_next_rebalance_time(now, rebalance_day, rebalance_hour):
-    days_ahead = (rebalance_day - now.weekday() + 7) % 7
-    if days_ahead == 0 and now.hour >= rebalance_hour:
+@lru_cache(maxsize=64)
+def _next_rebalance_cached(today, weekday, hour, rebalance_day, rebalance_hour):
+    """Pure core of calculate_next_rebalance_time, memoized across accounts in one run."""
+    days_ahead = (rebalance_day - weekday + 7) % 7
+    if days_ahead == 0 and hour >= rebalance_hour:
         days_ahead = 7
-    next_date = now.date() + timedelta(days=days_ahead)
+    next_date = today + timedelta(days=days_ahead)
     return datetime.combine(next_date, datetime.min.time()).replace(hour=rebalance_hour)
 
+def calculate_next_rebalance_time(now, rebalance_day, rebalance_hour):
+    return _next_rebalance_cached(now.date(), now.weekday(), now.hour, rebalance_day, rebalance_hour)
+
 def initialize_benchmark(db_client, config, account_id, initial_nav, prices, logger=None):
     investment = initial_nav / 2
     btc_units = investment / prices['BTCUSDT']
     eth_units = investment / prices['ETHUSDT']
     
+    # Single timestamp for next-rebalance calc and initialized_at
+    initialized_ts = datetime.now(UTC)
     next_rebalance = calculate_next_rebalance_time(
-        datetime.now(UTC), config['rebalance_day'], config['rebalance_hour']
+        initialized_ts, config['rebalance_day'], config['rebalance_hour']
     )
 
     if logger:
@@ -1093,7 +1274,7 @@ def initialize_benchmark(db_client, config, account_id, initial_nav, prices, log
                         "eth_investment": investment, "btc_units": btc_units, "eth_units": eth_units})
     
     # Set initialized_at to current timestamp to prevent duplicate transaction processing
-    initialized_at = datetime.now(UTC).isoformat()
+    initialized_at = initialized_ts.isoformat()
     
     with OperationTimer(logger, LogCategory.DATABASE, "update_benchmark_config", account_id) if logger else nullcontext():
         response = db_client.table('benchmark_configs').update({
@@ -1113,25 +1294,40 @@ def initialize_benchmark(db_client, config, account_id, initial_nav, prices, log
     # Benchmark initialized
     return response.data[0]
 
-def rebalance_benchmark(db_client, config, account_id, current_value, prices, logger=None):
+def rebalance_benchmark(db_client, config, account_id, current_value, prices, logger=None,
+                        pending_updates=None, pending_history=None):
+    """
+    Rebalance benchmark back to 50/50 BTC/ETH at current value.
+    If pending_updates / pending_history lists are given, the benchmark_configs
+    update and the benchmark_rebalance_history row are appended to them instead
+    of written immediately (see flush_benchmark_config_updates and
+    save_rebalance_history).
+    """
+    # Single timestamp for next-rebalance calc, history row and config update
+    rebalance_timestamp = datetime.now(UTC)
+    btc_price = prices['BTCUSDT']
+    eth_price = prices['ETHUSDT']
+    
     investment = current_value / 2
-    btc_units = investment / prices['BTCUSDT']
-    eth_units = investment / prices['ETHUSDT']
+    btc_units = investment / btc_price
+    eth_units = investment / eth_price
 
     next_rebalance = calculate_next_rebalance_time(
-        datetime.now(UTC), config['rebalance_day'], config['rebalance_hour']
+        rebalance_timestamp, config['rebalance_day'], config['rebalance_hour']
     )
 
     old_btc_units = float(config.get('btc_units', 0))
     old_eth_units = float(config.get('eth_units', 0))
-    rebalance_timestamp = datetime.now(UTC)
     
     # Calculate values before rebalancing
-    btc_value_before = old_btc_units * prices['BTCUSDT']
-    eth_value_before = old_eth_units * prices['ETHUSDT']
+    btc_value_before = old_btc_units * btc_price
+    eth_value_before = old_eth_units * eth_price
     total_value_before = btc_value_before + eth_value_before
-    btc_percentage_before = (btc_value_before / total_value_before * 100) if total_value_before > 0 else 0
-    eth_percentage_before = (eth_value_before / total_value_before * 100) if total_value_before > 0 else 0
+    if total_value_before > 0:
+        btc_percentage_before = btc_value_before / total_value_before * 100
+        eth_percentage_before = 100 - btc_percentage_before
+    else:
+        btc_percentage_before = eth_percentage_before = 0
     
     if logger:
         logger.info(LogCategory.REBALANCING, "rebalance_start", 
@@ -1147,8 +1343,13 @@ def rebalance_benchmark(db_client, config, account_id, current_value, prices, lo
                        "eth_investment": investment
                    })
 
+    # Calculate values after rebalancing
+    btc_value_after = btc_units * btc_price
+    eth_value_after = eth_units * eth_price
+    total_value_after = btc_value_after + eth_value_after
+    
     # Validation: Check that new benchmark units create a value close to current_value
-    calculated_benchmark = (btc_units * prices['BTCUSDT']) + (eth_units * prices['ETHUSDT'])
+    calculated_benchmark = total_value_after
     validation_error = abs(calculated_benchmark - current_value) / current_value if current_value != 0 else 0
     
     rebalance_status = "success"
@@ -1166,61 +1367,56 @@ def rebalance_benchmark(db_client, config, account_id, current_value, prices, lo
     current_count = config.get('rebalance_count', 0)
     new_count = current_count + 1
     
-    # Calculate values after rebalancing
-    btc_value_after = btc_units * prices['BTCUSDT']
-    eth_value_after = eth_units * prices['ETHUSDT']
-    total_value_after = btc_value_after + eth_value_after
+    rebalance_history_data = {
+        'account_id': account_id,
+        'rebalance_timestamp': rebalance_timestamp.isoformat(),
+        'btc_units_before': old_btc_units,
+        'eth_units_before': old_eth_units,
+        'btc_price': btc_price,
+        'eth_price': eth_price,
+        'btc_value_before': btc_value_before,
+        'eth_value_before': eth_value_before,
+        'total_value_before': total_value_before,
+        'btc_percentage_before': btc_percentage_before,
+        'eth_percentage_before': eth_percentage_before,
+        'btc_units_after': btc_units,
+        'eth_units_after': eth_units,
+        'btc_value_after': btc_value_after,
+        'eth_value_after': eth_value_after,
+        'total_value_after': total_value_after,
+        'rebalance_type': 'scheduled',
+        'status': rebalance_status,
+        'error_message': rebalance_error,
+        'validation_error': validation_error * 100  # Store as percentage
+    }
     
     # Save rebalance history
-    try:
-        rebalance_history_data = {
-            'account_id': account_id,
-            'rebalance_timestamp': rebalance_timestamp.isoformat(),
-            'btc_units_before': old_btc_units,
-            'eth_units_before': old_eth_units,
-            'btc_price': prices['BTCUSDT'],
-            'eth_price': prices['ETHUSDT'],
-            'btc_value_before': btc_value_before,
-            'eth_value_before': eth_value_before,
-            'total_value_before': total_value_before,
-            'btc_percentage_before': btc_percentage_before,
-            'eth_percentage_before': eth_percentage_before,
-            'btc_units_after': btc_units,
-            'eth_units_after': eth_units,
-            'btc_value_after': btc_value_after,
-            'eth_value_after': eth_value_after,
-            'total_value_after': total_value_after,
-            'rebalance_type': 'scheduled',
-            'status': rebalance_status,
-            'error_message': rebalance_error,
-            'validation_error': validation_error * 100  # Store as percentage
-        }
-        
-        db_client.table('benchmark_rebalance_history').insert(rebalance_history_data).execute()
-        
-        if logger:
-            logger.info(LogCategory.DATABASE, "rebalance_history_saved", 
-                       "Saved rebalance history record",
-                       account_id=account_id,
-                       data={"history_data": rebalance_history_data})
-    except Exception as e:
-        if logger:
-            logger.error(LogCategory.DATABASE, "rebalance_history_error", 
-                        f"Failed to save rebalance history: {str(e)}",
-                        account_id=account_id, error=str(e))
+    if pending_history is not None:
+        # Deferred write - caller inserts all history rows in one call
+        pending_history.append(rebalance_history_data)
+    else:
+        save_rebalance_history(db_client, [rebalance_history_data], logger)
     
-    with OperationTimer(logger, LogCategory.DATABASE, "update_rebalance_config", account_id) if logger else nullcontext():
-        response = db_client.table('benchmark_configs').update({
-            'btc_units': btc_units,
-            'eth_units': eth_units,
-            'next_rebalance_timestamp': next_rebalance.isoformat(),
-            'last_rebalance_timestamp': rebalance_timestamp.isoformat(),
-            'last_rebalance_status': rebalance_status,
-            'last_rebalance_error': rebalance_error,
-            'rebalance_count': new_count,
-            'last_rebalance_btc_units': old_btc_units,
-            'last_rebalance_eth_units': old_eth_units
-        }).eq('account_id', account_id).execute()
+    config_update = {
+        'btc_units': btc_units,
+        'eth_units': eth_units,
+        'next_rebalance_timestamp': next_rebalance.isoformat(),
+        'last_rebalance_timestamp': rebalance_timestamp.isoformat(),
+        'last_rebalance_status': rebalance_status,
+        'last_rebalance_error': rebalance_error,
+        'rebalance_count': new_count,
+        'last_rebalance_btc_units': old_btc_units,
+        'last_rebalance_eth_units': old_eth_units
+    }
+    
+    if pending_updates is not None:
+        # Deferred write - caller flushes all rebalanced configs in one upsert
+        pending_updates.append({'account_id': account_id, **config_update})
+        updated_config = {**config, **config_update}
+    else:
+        with OperationTimer(logger, LogCategory.DATABASE, "update_rebalance_config", account_id) if logger else nullcontext():
+            response = db_client.table('benchmark_configs').update(config_update).eq('account_id', account_id).execute()
+        updated_config = response.data[0]
     
     if logger:
         logger.info(LogCategory.REBALANCING, "rebalance_complete", 
@@ -1237,18 +1433,137 @@ def rebalance_benchmark(db_client, config, account_id, current_value, prices, lo
                    })
     
     # Benchmark rebalanced
-    return response.data[0]
+    return updated_config
+
+def save_rebalance_history(db_client, history_rows, logger=None):
+    """
+    Insert benchmark_rebalance_history rows in a single call. Failures are logged, not raised.
+    Called only with rows of accounts whose rebalanced config was flushed; a rejected row
+    only loses its own account's record.
+    """
+    if not history_rows:
+        return
+    
+    def insert(rows):
+        db_client.table('benchmark_rebalance_history').insert(rows).execute()
+    
+    try:
+        saved_rows, failed = write_rows_with_row_fallback(insert, history_rows)
+    except DB_WRITE_ERRORS as e:
+        if logger:
+            logger.error(LogCategory.DATABASE, "rebalance_history_error", 
+                        f"Failed to save rebalance history: {str(e)}",
+                        error=str(e), data={"account_ids": [row['account_id'] for row in history_rows]})
+        return
+    
+    if logger:
+        for row in saved_rows:
+            logger.info(LogCategory.DATABASE, "rebalance_history_saved", 
+                       "Saved rebalance history record",
+                       account_id=row['account_id'],
+                       data={"history_data": row})
+        for row, error in failed:
+            logger.error(LogCategory.DATABASE, "rebalance_history_error", 
+                        f"Failed to save rebalance history: {str(error)}",
+                        account_id=row['account_id'], error=str(error), data={"history_data": row})
+
+def write_rows_with_row_fallback(write, rows):
+    """
+    Writes rows in one call; if PostgREST rejects the batch, retries each row on its own.
+    A rejected batch is a single failed statement, so nothing of it was written and the retry
+    cannot duplicate rows. Transport errors propagate (the batch may have been committed).
+    Returns (saved_rows, failed) where failed is a list of (row, error).
+    """
+    try:
+        write(rows)
+        return rows, []
+    except APIError:
+        saved_rows, failed = [], []
+        for row in rows:
+            try:
+                write([row])
+                saved_rows.append(row)
+            except DB_WRITE_ERRORS as e:
+                failed.append((row, e))
+        return saved_rows, failed
+
+def flush_benchmark_config_updates(db_client, pending_updates, logger=None):
+    """
+    Write all deferred benchmark_configs updates in a single upsert round-trip.
+    A rejected row only fails its own account. Returns the account_ids whose config was saved;
+    the others rebalance again next run since next_rebalance_timestamp is unchanged.
+    """
+    if not pending_updates:
+        return set()
+    
+    def upsert(rows):
+        db_client.table('benchmark_configs').upsert(rows, on_conflict='account_id').execute()
+    
+    try:
+        with OperationTimer(logger, LogCategory.DATABASE, "flush_benchmark_configs") if logger else nullcontext():
+            saved_rows, failed = write_rows_with_row_fallback(upsert, pending_updates)
+    except DB_WRITE_ERRORS as e:
+        # Transport failure - the outcome is unknown, so no account counts as saved
+        if logger:
+            logger.error(LogCategory.DATABASE, "benchmark_configs_flush_error",
+                        f"Failed to save rebalanced benchmark configs: {str(e)}", error=str(e),
+                        data={"account_ids": [row['account_id'] for row in pending_updates]})
+        return set()
+    
+    if logger:
+        for row, error in failed:
+            logger.error(LogCategory.DATABASE, "benchmark_configs_flush_error",
+                        f"Failed to save rebalanced benchmark config: {str(error)}",
+                        account_id=row['account_id'], error=str(error))
+        if saved_rows:
+            logger.info(LogCategory.DATABASE, "benchmark_configs_flushed",
+                       f"Saved {len(saved_rows)} rebalanced benchmark configs",
+                       data={"account_ids": [row['account_id'] for row in saved_rows]})
+    return {row['account_id'] for row in saved_rows}
 
 def calculate_benchmark_value(config, prices):
-    btc_val = (float(config.get('btc_units') or 0)) * prices['BTCUSDT']
-    eth_val = (float(config.get('eth_units') or 0)) * prices['ETHUSDT']
+    btc_units = config.get('btc_units')
+    eth_units = config.get('eth_units')
+    
+    # Fast path: initialized configs already hold floats
+    if type(btc_units) is float and type(eth_units) is float:
+        return btc_units * prices['BTCUSDT'] + eth_units * prices['ETHUSDT']
+    
+    # Slow path: missing (uninitialized) or string/int/Decimal units
+    btc_val = (float(btc_units or 0)) * prices['BTCUSDT']
+    eth_val = (float(eth_units or 0)) * prices['ETHUSDT']
     return btc_val + eth_val
 
+def _transaction_inputs_valid(account_id, config, prices):
+    """Fast path of validate_transaction_inputs - same checks, no error messages."""
+    if not account_id or not isinstance(account_id, (int, str)):
+        return False
+    if not config or not isinstance(config, dict):
+        return False
+    if config.get('btc_units') is None or config.get('eth_units') is None:
+        return False
+    if not prices or not isinstance(prices, dict):
+        return False
+    for symbol in ('BTCUSDT', 'ETHUSDT'):
+        price = prices.get(symbol)
+        if not isinstance(price, (int, float)) or price <= 0:
+            return False
+    return True
+
 def validate_transaction_inputs(account_id, config, prices, logger=None):
     """
     Validuje vstupní parametry pro zpracování transakcí.
     Vrací True pokud jsou všechny požadované parametry validní.
     """
+    # Hot path: valid inputs skip building the error list
+    if _transaction_inputs_valid(account_id, config, prices):
+        if logger is not None and logger.is_enabled(LogLevel.DEBUG):
+            logger.debug(LogCategory.TRANSACTION, "validation_passed", 
+                        "Transaction input validation successful",
+                        account_id=account_id, 
+                        data={"config_keys": list(config.keys()), "price_symbols": list(prices.keys())})
+        return True
+    
     validation_errors = []
     
     # Validace account_id
@@ -1279,31 +1594,20 @@ def validate_transaction_inputs(account_id, config, prices, logger=None):
                 validation_errors.append(f"Invalid price value for {symbol}: {prices[symbol]}")
     
     # Logování výsledků validace
-    if validation_errors:
+    if logger:
         error_details = {
             "account_id": account_id,
             "validation_errors": validation_errors,
             "config_keys": list(config.keys()) if isinstance(config, dict) else None,
             "price_symbols": list(prices.keys()) if isinstance(prices, dict) else None
         }
-        
-        if logger:
-            logger.error(LogCategory.TRANSACTION, "validation_failed", 
-                        f"Transaction input validation failed: {'; '.join(validation_errors)}",
-                        account_id=account_id, error=str(validation_errors), data=error_details)
-        
-        return False
-    
-    # Validace prošla úspěšně
-    if logger:
-        logger.debug(LogCategory.TRANSACTION, "validation_passed", 
-                    "Transaction input validation successful",
-                    account_id=account_id, 
-                    data={"config_keys": list(config.keys()), "price_symbols": list(prices.keys())})
+        logger.error(LogCategory.TRANSACTION, "validation_failed", 
+                    f"Transaction input validation failed: {'; '.join(validation_errors)}",
+                    account_id=account_id, error=str(validation_errors), data=error_details)
     
-    return True
+    return False
 
-def process_deposits_withdrawals(db_client, binance_client, account_id, config, prices, logger=None):
+def process_deposits_withdrawals(db_client, binance_client, account_id, config, prices, logger=None, tick_ts=None):
     """
     Optimalizované zpracování deposits/withdrawals s idempotencí a atomic operations.
     Vrací aktualizovaný config s upravenými BTC/ETH units podle cashflow změn.
@@ -1311,13 +1615,28 @@ def process_deposits_withdrawals(db_client, binance_client, account_id, config,
     # Enhanced validation before processing
     if not validate_transaction_inputs(account_id, config, prices, logger):
         return config
-        
+    
+    # Debug messages below are only built when DEBUG entries are actually recorded
+    debug_enabled = logger is not None and logger.is_enabled(LogLevel.DEBUG)
     try:
         with OperationTimer(logger, LogCategory.TRANSACTION, "fetch_last_processed", account_id) if logger else nullcontext():
             last_processed = get_last_processed_time(db_client, account_id)
         
+        # Processed moments ago - Binance cannot have settled anything new yet, skip the API calls.
+        # last_processed is the previous run's tick start, so this only catches back-to-back warm
+        # invocations; min_poll_interval_seconds must stay below the shortest cron/daemon interval
+        # (30 s in the test environment) or scheduled ticks would randomly skip their fetch.
+        seconds_since_processed = (datetime.now(UTC) - datetime.fromisoformat(last_processed)).total_seconds()
+        if seconds_since_processed < settings.scheduling.min_poll_interval_seconds:
+            if debug_enabled:
+                logger.debug(LogCategory.TRANSACTION, "transactions_recently_processed", 
+                           f"Last processed {seconds_since_processed:.0f}s ago, skipping transaction fetch",
+                           account_id=account_id)
+            return config
+        
         with OperationTimer(logger, LogCategory.TRANSACTION, "fetch_new_transactions", account_id) if logger else nullcontext():
-            new_transactions = fetch_new_transactions(binance_client, last_processed, logger, account_id, prices)
+            new_transactions = [Txn.from_dict(raw) for raw in
+                                fetch_new_transactions(binance_client, last_processed, logger, account_id, prices)]
         
         # Filter out transactions that have already been processed
         unprocessed_transactions = filter_unprocessed_transactions(db_client, new_transactions, account_id, logger)
@@ -1326,13 +1645,13 @@ def process_deposits_withdrawals(db_client, binance_client, account_id, config,
         initialized_at = config.get('initialized_at')
         if initialized_at:
             # Convert initialized_at to datetime for comparison
-            initialized_dt = datetime.fromisoformat(initialized_at.replace('Z', '+00:00'))
+            initialized_dt = datetime.fromisoformat(initialized_at)
             pre_init_count = len(unprocessed_transactions)
             
             # Filter out transactions before initialization
             unprocessed_transactions = [
                 txn for txn in unprocessed_transactions
-                if datetime.fromisoformat(txn['timestamp'].replace('Z', '+00:00')) >= initialized_dt
+                if datetime.fromisoformat(txn.timestamp) >= initialized_dt
             ]
             
             filtered_count = pre_init_count - len(unprocessed_transactions)
@@ -1343,7 +1662,7 @@ def process_deposits_withdrawals(db_client, binance_client, account_id, config,
                            data={"filtered_count": filtered_count, "initialized_at": initialized_at})
         
         if not unprocessed_transactions:
-            if logger:
+            if debug_enabled:
                 logger.debug(LogCategory.TRANSACTION, "no_new_transactions", 
                            "No new transactions found (after deduplication and pre-init filtering)", account_id=account_id)
             return config
@@ -1356,61 +1675,63 @@ def process_deposits_withdrawals(db_client, binance_client, account_id, config,
         # Batch zpracování všech nových transakcí
         total_net_flow = 0  # Kladné = deposit, záporné = withdrawal
         processed_txns = []
+        account_id_str = str(account_id)  # processed_transactions stores account_id as string
         
         for txn in unprocessed_transactions:
-            if txn['status'] == 'SUCCESS':  # Pouze úspěšné transakce
-                amount = float(txn['amount'])
+            if txn.status == 'SUCCESS':  # Pouze úspěšné transakce
+                amount = txn.amount
+                txn_type = txn.type
+                metadata = txn.metadata
                 
                 # Validate transaction type
-                valid_types = ['DEPOSIT', 'WITHDRAWAL', 'PAY_DEPOSIT', 'PAY_WITHDRAWAL', 'FEE_WITHDRAWAL', 'SUB_DEPOSIT', 'SUB_WITHDRAWAL']
-                if not txn.get('type'):
+                if not txn_type:
                     if logger:
                         logger.error(LogCategory.TRANSACTION, "missing_transaction_type", 
                                    f"Transaction missing 'type' field",
-                                   account_id=account_id, data={"transaction": txn})
+                                   account_id=account_id, data={"transaction": asdict(txn)})
                     continue
                 
-                if txn['type'] not in valid_types:
+                if txn_type not in VALID_TRANSACTION_TYPES:
                     if logger:
                         logger.error(LogCategory.TRANSACTION, "invalid_transaction_type", 
-                                   f"Invalid transaction type: {txn['type']}. Valid types: {valid_types}",
-                                   account_id=account_id, data={"transaction": txn})
+                                   f"Invalid transaction type: {txn_type}. Valid types: {sorted(VALID_TRANSACTION_TYPES)}",
+                                   account_id=account_id, data={"transaction": asdict(txn)})
                     continue
                 
                 # For deposits, check if we have USD value in metadata
-                if txn['type'] in ['DEPOSIT', 'PAY_DEPOSIT', 'SUB_DEPOSIT']:
+                if txn_type in DEPOSIT_TYPES:
                     # Try to get USD value from metadata if available
-                    if txn['type'] in ['DEPOSIT', 'SUB_DEPOSIT'] and txn.get('metadata') and txn['metadata'].get('usd_value') is not None:
-                        usd_amount = float(txn['metadata']['usd_value'])
+                    if txn_type in CRYPTO_DEPOSIT_TYPES and metadata and metadata.get('usd_value') is not None:
+                        usd_amount = float(metadata['usd_value'])
                         total_net_flow += usd_amount
-                        if logger:
+                        if debug_enabled:
                             logger.debug(LogCategory.TRANSACTION, "deposit_usd_value",
-                                       f"Using USD value for {txn['type'].lower()}: ${usd_amount:.2f} (from {amount} {txn['metadata'].get('coin', 'UNKNOWN')})",
+                                       f"Using USD value for {txn_type.lower()}: ${usd_amount:.2f} (from {amount} {metadata.get('coin', 'UNKNOWN')})",
                                        account_id=account_id)
-                    elif txn['type'] in ['DEPOSIT', 'SUB_DEPOSIT'] and txn.get('metadata') and txn['metadata'].get('price_missing'):
+                    elif txn_type in CRYPTO_DEPOSIT_TYPES and metadata and metadata.get('price_missing'):
                         # Skip deposits without USD value for cashflow calculation
                         if logger:
                             logger.warning(LogCategory.TRANSACTION, "deposit_skipped_no_price",
-                                         f"Skipping {txn['type'].lower()} without USD value: {amount} {txn['metadata'].get('coin', 'UNKNOWN')}",
+                                         f"Skipping {txn_type.lower()} without USD value: {amount} {metadata.get('coin', 'UNKNOWN')}",
                                          account_id=account_id,
-                                         data={'transaction_id': txn['id'], 'amount': amount, 'coin': txn['metadata'].get('coin')})
+                                         data={'transaction_id': txn.id, 'amount': amount, 'coin': metadata.get('coin')})
                     else:
                         # Fallback to raw amount (assumes USD for stablecoins or PAY deposits)
                         total_net_flow += amount
-                elif txn['type'] in ['WITHDRAWAL', 'PAY_WITHDRAWAL', 'FEE_WITHDRAWAL', 'SUB_WITHDRAWAL']:
+                elif txn_type in WITHDRAWAL_TYPES:
                     total_net_flow -= amount
                     
                 processed_txns.append({
-                    'account_id': str(account_id),  # Ensure it's a string
-                    'transaction_id': str(txn['id']),
-                    'type': txn['type'],  # Changed from 'transaction_type' to 'type'
-                    'amount': float(amount),  # Ensure it's a proper float
-                    'timestamp': txn['timestamp'],
-                    'status': txn['status'],
-                    'metadata': txn.get('metadata')  # Save transaction metadata if present
+                    'account_id': account_id_str,
+                    'transaction_id': str(txn.id),
+                    'type': txn_type,  # Changed from 'transaction_type' to 'type'
+                    'amount': amount,  # Already parsed to float by Txn.from_dict
+                    'timestamp': txn.timestamp,
+                    'status': txn.status,
+                    'metadata': metadata  # Save transaction metadata if present
                 })
         
-        if total_net_flow != 0:
+        if abs(total_net_flow) >= MIN_CASHFLOW_USD:
             if logger:
                 logger.info(LogCategory.TRANSACTION, "cashflow_detected", 
                            f"Net cashflow detected: ${total_net_flow:+,.2f}",
@@ -1418,32 +1739,20 @@ def process_deposits_withdrawals(db_client, binance_client, account_id, config,
             
             # Atomic update: benchmark config + processed transactions
             updated_config = adjust_benchmark_for_cashflow(
-                db_client, config, account_id, total_net_flow, prices, processed_txns, logger
+                db_client, config, account_id, total_net_flow, prices, processed_txns, logger,
+                tick_ts=tick_ts
             )
             return updated_config
         else:
             # Žádné cashflow změny, jen uložíme tracking
             if processed_txns:
                 with OperationTimer(logger, LogCategory.DATABASE, "save_processed_transactions", account_id) if logger else nullcontext():
-                    try:
-                        db_client.table('processed_transactions').insert(processed_txns).execute()
-                        update_last_processed_time(db_client, account_id)
-                        
-                        if logger:
-                            logger.info(LogCategory.TRANSACTION, "transactions_saved", 
-                                       f"Saved {len(processed_txns)} transactions with no net cashflow",
-                                       account_id=account_id)
-                    except Exception as e:
-                        # Check if it's a duplicate key error
-                        error_msg = str(e)
-                        if 'duplicate key' in error_msg.lower() or 'unique constraint' in error_msg.lower():
-                            if logger:
-                                logger.warning(LogCategory.TRANSACTION, "duplicate_transaction_ignored", 
-                                             f"Some transactions already processed, ignoring duplicates",
-                                             account_id=account_id)
-                        else:
-                            # Re-raise other errors
-                            raise
+                    save_processed_transactions(db_client, account_id, processed_txns, logger, tick_ts=tick_ts)
+                    
+                    if logger:
+                        logger.info(LogCategory.TRANSACTION, "transactions_saved", 
+                                   f"Saved {len(processed_txns)} transactions with no net cashflow",
+                                   account_id=account_id)
             return config
             
     except Exception as e:
@@ -1465,16 +1774,49 @@ def process_deposits_withdrawals(db_client, binance_client, account_id, config,
 
 def get_last_processed_time(db_client, account_id):
     """Get timestamp of last processing for given account."""
+    cached = _last_processed_cache.get(str(account_id))
+    if cached and time.monotonic() - cached[1] < LAST_PROCESSED_CACHE_TTL_SECONDS:
+        return cached[0]
+    
     try:
-        response = db_client.table('account_processing_status').select('last_processed_timestamp').eq('account_id', account_id).execute()
-        if response.data:
-            return response.data[0]['last_processed_timestamp']
+        # maybe_single() returns the row object directly (or None when the account has no status yet)
+        response = db_client.table('account_processing_status').select('last_processed_timestamp').eq('account_id', account_id).maybe_single().execute()
+        if response and response.data:
+            last_processed = response.data['last_processed_timestamp']
+            _last_processed_cache[str(account_id)] = (last_processed, time.monotonic())
+            return last_processed
         else:
             # První spuštění - začneme od před 30 dny
             return (datetime.now(UTC) - timedelta(days=settings.scheduling.historical_period_days)).isoformat()
     except:
         return (datetime.now(UTC) - timedelta(days=settings.scheduling.historical_period_days)).isoformat()
 
+def is_missing_rpc_error(error):
+    """True only when an RPC failed because the database function is not deployed."""
+    return isinstance(error, APIError) and error.code == MISSING_RPC_ERROR_CODE
+
+def known_processed_transactions(account_id):
+    """Vrátí ID transakcí zapamatovaná pro účet (prázdné, pokud záznam vypršel)."""
+    cached = _processed_id_cache.get(account_id)
+    if not cached:
+        return {}
+    if time.monotonic() - cached[1] >= LAST_PROCESSED_CACHE_TTL_SECONDS:
+        _processed_id_cache.pop(account_id, None)
+        return {}
+    return cached[0]
+
+def remember_processed_transactions(account_id, transaction_ids):
+    """Zapamatuje si ID transakcí, které už jsou v processed_transactions."""
+    known_ids = known_processed_transactions(account_id)
+    if not known_ids:
+        _processed_id_cache[account_id] = (known_ids, time.monotonic())
+    for transaction_id in transaction_ids:
+        # Re-inserting moves the ID to the most recent end
+        known_ids.pop(transaction_id, None)
+        known_ids[transaction_id] = None
+    while len(known_ids) > PROCESSED_ID_CACHE_MAX_PER_ACCOUNT:
+        del known_ids[next(iter(known_ids))]
+
 def filter_unprocessed_transactions(db_client, transactions, account_id, logger=None):
     """
     Filtruje transakce, které už byly zpracovány (existují v processed_transactions).
@@ -1482,18 +1824,33 @@ def filter_unprocessed_transactions(db_client, transactions, account_id, logger=
     if not transactions:
         return []
     
+    debug_enabled = logger is not None and logger.is_enabled(LogLevel.DEBUG)
     try:
+        # Transakce známé z dřívějších běhů vyřadíme bez dotazu do DB
+        known_ids = known_processed_transactions(account_id)
+        candidates = [txn for txn in transactions if txn.id not in known_ids]
+        if not candidates:
+            if debug_enabled:
+                logger.debug(LogCategory.TRANSACTION, "deduplication_check", 
+                           f"All {len(transactions)} transactions already processed (cached)",
+                           account_id=account_id, data={"total_fetched": len(transactions), "new_count": 0})
+            return []
+        
         # Získáme ID všech transakcí, které chceme zkontrolovat
-        transaction_ids = [txn['id'] for txn in transactions]
+        transaction_ids = [txn.id for txn in candidates]
         
         # Zkontrolujeme, které už existují v databázi
-        existing_response = db_client.table('processed_transactions').select('transaction_id').eq('account_id', account_id).in_('transaction_id', transaction_ids).execute()
-        existing_ids = {row['transaction_id'] for row in existing_response.data}
+        existing_ids = set()
+        for start in range(0, len(transaction_ids), PROCESSED_ID_LOOKUP_BATCH_SIZE):
+            batch = transaction_ids[start:start + PROCESSED_ID_LOOKUP_BATCH_SIZE]
+            existing_response = db_client.table('processed_transactions').select('transaction_id').eq('account_id', account_id).in_('transaction_id', batch).execute()
+            existing_ids.update(row['transaction_id'] for row in existing_response.data)
+        remember_processed_transactions(account_id, existing_ids)
         
         # Filtrujeme jen ty, které ještě nebyly zpracovány
-        unprocessed = [txn for txn in transactions if txn['id'] not in existing_ids]
+        unprocessed = [txn for txn in candidates if txn.id not in existing_ids]
         
-        if logger:
+        if debug_enabled:
             logger.debug(LogCategory.TRANSACTION, "deduplication_check", 
                        f"Filtered {len(transactions)} transactions: {len(unprocessed)} new, {len(existing_ids)} already processed",
                        account_id=account_id, 
@@ -1515,12 +1872,14 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
     Kombinuje oba API calls pro minimální latenci.
     Includes USD conversion for crypto deposits/withdrawals.
     """
+    # Debug messages/data below are only built when DEBUG entries are actually recorded
+    debug_enabled = logger is not None and logger.is_enabled(LogLevel.DEBUG)
     try:
         transactions = []
         
         # Enhanced timestamp validation
         try:
-            start_timestamp = int(datetime.fromisoformat(start_time.replace('Z', '+00:00')).timestamp() * 1000)
+            start_timestamp = int(datetime.fromisoformat(start_time).timestamp() * 1000)
         except (ValueError, AttributeError) as e:
             error_msg = f"Invalid start_time format: {start_time}"
             if logger:
@@ -1528,18 +1887,27 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                            account_id=account_id, error=str(e))
             raise ValueError(error_msg)
         
-        if logger:
+        if debug_enabled:
             logger.debug(LogCategory.API_CALL, "fetch_transactions_start", 
                         f"Fetching transactions since {start_time}",
                         account_id=account_id, data={"start_timestamp": start_timestamp})
         
+        # The three endpoints are independent round-trips, so fetch them concurrently.
+        # Results (and exceptions) are collected below with individual error handling.
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            deposits_future = executor.submit(binance_client.get_deposit_history, startTime=start_timestamp)
+            withdrawals_future = executor.submit(binance_client.get_withdraw_history, startTime=start_timestamp)
+            # Use our helper to work around python-binance bug
+            pay_future = executor.submit(get_pay_transactions, binance_client.API_KEY, binance_client.API_SECRET,
+                                         logger, account_id, start_time=start_timestamp)
+        
         # Enhanced API calls with individual error handling
         deposits = []
         withdrawals = []
         
         try:
-            deposits = binance_client.get_deposit_history(startTime=start_timestamp)
-            if logger:
+            deposits = deposits_future.result()
+            if debug_enabled:
                 logger.debug(LogCategory.API_CALL, "deposits_fetched", 
                            f"Fetched {len(deposits)} deposits", account_id=account_id)
         except Exception as e:
@@ -1550,8 +1918,8 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
             # Continue with empty deposits list
         
         try:
-            withdrawals = binance_client.get_withdraw_history(startTime=start_timestamp)
-            if logger:
+            withdrawals = withdrawals_future.result()
+            if debug_enabled:
                 logger.debug(LogCategory.API_CALL, "withdrawals_fetched", 
                            f"Fetched {len(withdrawals)} withdrawals", account_id=account_id)
         except Exception as e:
@@ -1564,25 +1932,16 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
         # Fetch Binance Pay transactions (phone/email transfers)
         pay_transactions = []
         try:
-            # Use our helper to work around python-binance bug
-            api_key = binance_client.API_KEY
-            api_secret = binance_client.API_SECRET
-            
             # Get pay transactions using direct API call
-            pay_transactions = get_pay_transactions(api_key, api_secret, logger, account_id)
+            pay_transactions = pay_future.result()
             
             if pay_transactions:
                 
-                # Filter transactions by time
-                filtered_pay_transactions = []
-                for pay_txn in pay_transactions:
-                    txn_time = int(pay_txn.get('transactionTime', 0))
-                    if txn_time >= start_timestamp:
-                        filtered_pay_transactions.append(pay_txn)
+                # Filter transactions by time (startTime is also sent to the API; this guards the boundary)
+                pay_transactions = [pay_txn for pay_txn in pay_transactions
+                                    if int(pay_txn.get('transactionTime', 0)) >= start_timestamp]
                 
-                pay_transactions = filtered_pay_transactions
-                
-                if logger:
+                if debug_enabled:
                     logger.debug(LogCategory.API_CALL, "pay_transactions_fetched", 
                                f"Fetched {len(pay_transactions)} pay transactions", account_id=account_id)
         except Exception as e:
@@ -1600,6 +1959,10 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                              account_id=account_id, error=str(e), data=error_details)
             # Continue with empty pay transactions list
         
+        # USD price per coin, resolved once per distinct coin: {coin: (coin_price, price_source)}
+        coin_usd_prices = {}
+        btc_price = prices.get('BTCUSDT') if prices else None
+        
         # Enhanced transaction normalization with error handling
         for deposit in deposits:
             try:
@@ -1609,6 +1972,10 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                                      f"Skipping invalid deposit data: {deposit}", account_id=account_id)
                     continue
                 
+                # Pending/failed deposits are never processed - skip them before any price lookup
+                if deposit.get('status') != DEPOSIT_SUCCESS_STATUS:
+                    continue
+                
                 # Extract deposit details
                 coin = deposit.get('coin', '')
                 amount = float(deposit.get('amount', 0))
@@ -1619,13 +1986,19 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                 price_source = None
                 
                 if coin:
-                    # Get BTC price from prices dict if available
-                    btc_price = prices.get('BTCUSDT') if prices else None
-                    
-                    # Use our utility function to get USD value
-                    usd_value, coin_price, price_source = get_coin_usd_value(
-                        binance_client, coin, amount, btc_price, logger, account_id
-                    )
+                    if amount <= 0:
+                        usd_value = 0.0
+                    else:
+                        if coin not in coin_usd_prices:
+                            # Use our utility function to get the unit USD price (one lookup per coin)
+                            _, unit_price, unit_source = get_coin_usd_value(
+                                binance_client, coin, 1.0, btc_price, logger, account_id
+                            )
+                            coin_usd_prices[coin] = (unit_price, unit_source)
+                        
+                        coin_price, price_source = coin_usd_prices[coin]
+                        if coin_price is not None:
+                            usd_value = amount * coin_price
                     
                     # If we couldn't get the price, mark it for later processing
                     if usd_value is None:
@@ -1640,17 +2013,19 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                     'type': 'DEPOSIT',
                     'amount': float(deposit.get('amount', 0)),
                     'timestamp': deposit.get('insertTime', 0),
-                    'status': deposit.get('status', 0),  # 0=pending, 1=success
+                    'status': 'SUCCESS',
                     # Metadata for deposits
-                    'coin': coin,
-                    'network': deposit.get('network', ''),
-                    'address': deposit.get('address', ''),
-                    'address_tag': deposit.get('addressTag', ''),
-                    'tx_id': deposit.get('txId', ''),
-                    'usd_value': usd_value,
-                    'coin_price': coin_price,
-                    'price_source': price_source,
-                    'price_missing': usd_value is None
+                    'metadata': {
+                        'coin': coin,
+                        'network': deposit.get('network', ''),
+                        'address': deposit.get('address', ''),
+                        'address_tag': deposit.get('addressTag', ''),
+                        'tx_id': deposit.get('txId', ''),
+                        'usd_value': usd_value,
+                        'coin_price': coin_price,
+                        'price_source': price_source,
+                        'price_missing': usd_value is None
+                    }
                 })
                 
                 # Log deposit for visibility
@@ -1688,14 +2063,18 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                         logger.warning(LogCategory.API_CALL, "invalid_withdrawal_data", 
                                      f"Skipping invalid withdrawal data: {withdrawal}", account_id=account_id)
                     continue
+                
+                # Only completed withdrawals (status 6) are processed - status 1 is Cancelled
+                if withdrawal.get('status') != WITHDRAWAL_COMPLETED_STATUS:
+                    continue
                     
                 # Check if this is a fee withdrawal (can be marked in withdrawal info/description)
                 withdrawal_type = 'WITHDRAWAL'
-                withdrawal_info = withdrawal.get('info', '').lower()
-                withdrawal_note = withdrawal.get('withdrawOrderDescription', '').lower()
+                withdrawal_info = withdrawal.get('info', '')
+                withdrawal_note = withdrawal.get('withdrawOrderDescription', '')
                 
                 # Check for fee indicators in withdrawal metadata
-                if any(fee_indicator in withdrawal_info + withdrawal_note for fee_indicator in ['fee', 'management', 'performance', 'commission']):
+                if FEE_INDICATOR_RE.search(withdrawal_info) or FEE_INDICATOR_RE.search(withdrawal_note):
                     withdrawal_type = 'FEE_WITHDRAWAL'
                     if logger:
                         logger.info(LogCategory.TRANSACTION, "fee_withdrawal_detected",
@@ -1708,14 +2087,16 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
                     'type': withdrawal_type, 
                     'amount': float(withdrawal.get('amount', 0)),
                     'timestamp': withdrawal.get('applyTime', 0),
-                    'status': withdrawal.get('status', 0),  # 0=pending, 1=success, etc.
+                    'status': 'SUCCESS',
                     # Metadata for debugging and future analysis
-                    'transfer_type': withdrawal.get('transferType', 0),  # 0=external, 1=internal
-                    'tx_id': withdrawal.get('txId', ''),  # "Internal transfer" for internal
-                    'coin': withdrawal.get('coin', ''),  # Currency
-                    'network': withdrawal.get('network', ''),  # Network for external
-                    'info': withdrawal.get('info', ''),
-                    'note': withdrawal.get('withdrawOrderDescription', '')
+                    'metadata': {
+                        'transfer_type': withdrawal.get('transferType', 0),  # 0=external, 1=internal
+                        'tx_id': withdrawal.get('txId', ''),  # "Internal transfer" for internal
+                        'coin': withdrawal.get('coin', ''),  # Currency
+                        'network': withdrawal.get('network', ''),  # Network for external
+                        'info': withdrawal.get('info', ''),
+                        'note': withdrawal.get('withdrawOrderDescription', '')
+                    }
                 })
                 
                 # Log internal transfers for debugging
@@ -1808,51 +2189,22 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
         # This needs to be done from the perspective of the master account
         # We'll handle this separately in process_single_account
             
-        # Filtrujeme jen SUCCESS transakce a sortujeme podle času
-        successful_txns = []
-        for txn in transactions:
-            # Different status codes for deposits (1) and withdrawals (6=completed)
-            if (txn['status'] == 1 or txn['status'] == 6 or txn['status'] == 'SUCCESS'):  # Binance používá různé formáty
-                txn['status'] = 'SUCCESS'
-                txn['timestamp'] = datetime.fromtimestamp(txn['timestamp']/1000, UTC).isoformat()
-                
-                # Preserve metadata for deposits
-                if txn['type'] == 'DEPOSIT' and any(key in txn for key in ['coin', 'network', 'address', 'address_tag', 'tx_id', 'usd_value', 'coin_price', 'price_source', 'price_missing']):
-                    txn['metadata'] = {
-                        'coin': txn.pop('coin', ''),
-                        'network': txn.pop('network', ''),
-                        'address': txn.pop('address', ''),
-                        'address_tag': txn.pop('address_tag', ''),
-                        'tx_id': txn.pop('tx_id', ''),
-                        'usd_value': txn.pop('usd_value', None),
-                        'coin_price': txn.pop('coin_price', None),
-                        'price_source': txn.pop('price_source', None),
-                        'price_missing': txn.pop('price_missing', False)
-                    }
-                
-                # Preserve metadata for withdrawals
-                if txn['type'] in ['WITHDRAWAL', 'FEE_WITHDRAWAL'] and any(key in txn for key in ['transfer_type', 'tx_id', 'coin', 'network', 'info', 'note']):
-                    txn['metadata'] = {
-                        'transfer_type': txn.pop('transfer_type', 0),
-                        'tx_id': txn.pop('tx_id', ''),
-                        'coin': txn.pop('coin', ''),
-                        'network': txn.pop('network', ''),
-                        'info': txn.pop('info', ''),
-                        'note': txn.pop('note', '')
-                    }
-                
-                # Preserve metadata for PAY transactions (already has metadata dict)
-                # PAY transactions already have metadata from processing above
-                    
-                successful_txns.append(txn)
+        # Non-SUCCESS rows were skipped during normalization; only timestamps remain to convert
+        successful_txns = transactions
+        total_count = len(deposits) + len(withdrawals) + len(pay_transactions)
+        # Sort on the raw millisecond ints, then format once in time order
+        successful_txns.sort(key=itemgetter('timestamp'))
+        fromtimestamp = datetime.fromtimestamp
+        for txn in successful_txns:
+            txn['timestamp'] = fromtimestamp(txn['timestamp'] / 1000, UTC).isoformat()
         
         if logger:
             logger.info(LogCategory.API_CALL, "transactions_fetched", 
-                       f"Fetched {len(successful_txns)} successful transactions (from {len(transactions)} total)",
+                       f"Fetched {len(successful_txns)} successful transactions (from {total_count} total)",
                        account_id=account_id, 
-                       data={"successful_count": len(successful_txns), "total_count": len(transactions)})
+                       data={"successful_count": len(successful_txns), "total_count": total_count})
                 
-        return sorted(successful_txns, key=lambda x: x['timestamp'])
+        return successful_txns
         
     except Exception as e:
         if logger:
@@ -1862,13 +2214,15 @@ def fetch_new_transactions(binance_client, start_time, logger=None, account_id=N
         # Error fetching transaction history
         return []
 
-def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, prices, processed_txns, logger=None):
+def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, prices, processed_txns, logger=None,
+                                  tick_ts=None):
     """
     Atomic adjustment benchmarku podle net cashflow.
     Při depositu: zvýší BTC/ETH units proporcionálně
     Při withdrawal: sníží BTC/ETH units proporcionálně
+    The given config is updated in place (only after the DB write succeeded) and returned.
     """
-    # Enhanced input validation and error context
+    # Enhanced input validation and error context (only feeds log entries, so built only with a logger)
     validation_context = {
         "account_id": account_id,
         "net_flow": net_flow,
@@ -1878,7 +2232,7 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
         "config_keys": list(config.keys()) if isinstance(config, dict) else None,
         "price_symbols": list(prices.keys()) if isinstance(prices, dict) else None,
         "config_has_initialized_at": bool(config.get('initialized_at')) if config else False
-    }
+    } if logger else None
     
     # Validation: Check if benchmark is properly initialized
     if not config.get('initialized_at'):
@@ -1888,13 +2242,13 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
                         error_msg, account_id=account_id, error=error_msg, data=validation_context)
         raise ValueError(error_msg)
     
-    if logger:
+    if logger is not None and logger.is_enabled(LogLevel.DEBUG):
         logger.debug(LogCategory.TRANSACTION, "benchmark_adjustment_start",
                     f"Starting benchmark adjustment for net flow: ${net_flow:.2f}",
                     account_id=account_id, data=validation_context)
     
     # Validate critical inputs
-    if not isinstance(net_flow, (int, float)) or abs(net_flow) < 0.01:
+    if not isinstance(net_flow, (int, float)) or abs(net_flow) < MIN_CASHFLOW_USD:
         error_msg = f"Invalid net_flow value: {net_flow}"
         if logger:
             logger.error(LogCategory.TRANSACTION, "adjust_benchmark_error", 
@@ -1918,14 +2272,17 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
     try:
         current_btc_units = float(config.get('btc_units', 0))
         current_eth_units = float(config.get('eth_units', 0))
+        btc_price = prices['BTCUSDT']
+        eth_price = prices['ETHUSDT']
         
         if net_flow > 0:  # DEPOSIT - přidáváme do benchmarku
             # Rozdělíme deposit 50/50 mezi BTC a ETH
-            btc_investment = net_flow / 2
-            eth_investment = net_flow / 2
+            btc_investment = eth_investment = net_flow / 2
             
-            new_btc_units = current_btc_units + (btc_investment / prices['BTCUSDT'])
-            new_eth_units = current_eth_units + (eth_investment / prices['ETHUSDT'])
+            btc_units_bought = btc_investment / btc_price
+            eth_units_bought = eth_investment / eth_price
+            new_btc_units = current_btc_units + btc_units_bought
+            new_eth_units = current_eth_units + eth_units_bought
             
             if logger:
                 logger.info(LogCategory.TRANSACTION, "process_deposit", 
@@ -1939,16 +2296,16 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
             withdrawal_amount = abs(net_flow)
             
             # Zjistíme aktuální hodnotu benchmarku
-            current_benchmark_value = (current_btc_units * prices['BTCUSDT']) + (current_eth_units * prices['ETHUSDT'])
+            current_benchmark_value = (current_btc_units * btc_price) + (current_eth_units * eth_price)
             
-            if current_benchmark_value > 0:
-                # Proporcionální snížení podle withdrawal
-                reduction_ratio = withdrawal_amount / current_benchmark_value
-                new_btc_units = current_btc_units * (1 - reduction_ratio)
-                new_eth_units = current_eth_units * (1 - reduction_ratio)
-            else:
-                new_btc_units = current_btc_units
-                new_eth_units = current_eth_units
+            # Proporcionální snížení podle withdrawal (one scale factor for both legs)
+            reduction_ratio = withdrawal_amount / current_benchmark_value if current_benchmark_value > 0 else 0
+            remaining_ratio = 1 - reduction_ratio
+            new_btc_units = current_btc_units * remaining_ratio
+            new_eth_units = current_eth_units * remaining_ratio
+            # Negative: units removed from the benchmark
+            btc_units_bought = new_btc_units - current_btc_units
+            eth_units_bought = new_eth_units - current_eth_units
             
             if logger:
                 logger.info(LogCategory.TRANSACTION, "process_withdrawal", 
@@ -1956,39 +2313,41 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
                            account_id=account_id,
                            data={"net_flow": net_flow, "withdrawal_amount": withdrawal_amount,
                                 "current_benchmark_value": current_benchmark_value,
-                                "reduction_ratio": reduction_ratio if current_benchmark_value > 0 else 0,
+                                "reduction_ratio": reduction_ratio,
                                 "new_btc_units": new_btc_units, "new_eth_units": new_eth_units})
         
         # Determine modification type from processed transactions
         modification_type = 'deposit' if net_flow > 0 else 'withdrawal'
         
-        # Check if it's a fee withdrawal
-        if processed_txns and any(txn['type'] == 'FEE_WITHDRAWAL' for txn in processed_txns):
-            modification_type = 'fee_withdrawal'
-        
         # Get transaction details for reference
         transaction_id = None
         transaction_type = None
         if processed_txns:
             # Use the first transaction as primary reference
-            transaction_id = processed_txns[0].get('transaction_id')
-            transaction_type = processed_txns[0].get('type')
+            first_txn = processed_txns[0]
+            transaction_id = first_txn.get('transaction_id')
+            transaction_type = first_txn.get('type')
+            
+            # Check if it's a fee withdrawal (any() stops at the first match)
+            if any(txn['type'] == 'FEE_WITHDRAWAL' for txn in processed_txns):
+                modification_type = 'fee_withdrawal'
         
         # Prepare modification history data
-        modification_timestamp = datetime.now(UTC)
+        modification_timestamp = tick_ts or datetime.now(UTC)
+        modification_ts_iso = modification_timestamp.isoformat()
         modification_data = {
             'account_id': account_id,
-            'modification_timestamp': modification_timestamp.isoformat(),
+            'modification_timestamp': modification_ts_iso,
             'modification_type': modification_type,
             'btc_units_before': current_btc_units,
             'eth_units_before': current_eth_units,
             'cashflow_amount': net_flow,
-            'btc_price': prices['BTCUSDT'],
-            'eth_price': prices['ETHUSDT'],
+            'btc_price': btc_price,
+            'eth_price': eth_price,
             'btc_allocation': btc_investment if net_flow > 0 else None,
             'eth_allocation': eth_investment if net_flow > 0 else None,
-            'btc_units_bought': (btc_investment / prices['BTCUSDT']) if net_flow > 0 else -(current_btc_units - new_btc_units),
-            'eth_units_bought': (eth_investment / prices['ETHUSDT']) if net_flow > 0 else -(current_eth_units - new_eth_units),
+            'btc_units_bought': btc_units_bought,
+            'eth_units_bought': eth_units_bought,
             'btc_units_after': new_btc_units,
             'eth_units_after': new_eth_units,
             'transaction_id': transaction_id,
@@ -1996,11 +2355,10 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
         }
         
         # Enhanced atomic database update with transaction safety
-        # Convert to Decimal for proper JSON serialization
-        from decimal import Decimal
+        # Round to 12 decimals (the units are sent as JSON floats anyway)
         update_data = {
-            'btc_units': float(Decimal(str(new_btc_units)).quantize(Decimal('0.000000000001'))),
-            'eth_units': float(Decimal(str(new_eth_units)).quantize(Decimal('0.000000000001')))
+            'btc_units': round(new_btc_units, 12),
+            'eth_units': round(new_eth_units, 12)
         }
         
         atomic_context = {
@@ -2008,87 +2366,113 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
             "update_data": update_data,
             "processed_txns_count": len(processed_txns) if processed_txns else 0,
             "operation_type": "atomic_cashflow_update"
-        }
+        } if logger else None
         
         with OperationTimer(logger, LogCategory.DATABASE, "atomic_cashflow_update", account_id) if logger else nullcontext():
             try:
-                # 1. Update benchmark config first
-                config_result = db_client.table('benchmark_configs').update(update_data).eq('account_id', account_id).execute()
-                
-                if not config_result.data:
-                    error_msg = f"Failed to update benchmark_configs for account_id {account_id} - no rows affected"
+                try:
+                    # All writes in one round-trip and one DB transaction
+                    rpc_result = db_client.rpc('atomic_cashflow_update', {
+                        'p_account_id': str(account_id),
+                        'p_btc_units': update_data['btc_units'],
+                        'p_eth_units': update_data['eth_units'],
+                        'p_modification': modification_data,
+                        'p_txns': processed_txns or [],
+                        'p_processed_at': modification_ts_iso
+                    }).execute()
+                    _last_processed_cache[str(account_id)] = (modification_ts_iso, time.monotonic())
+                    if processed_txns:
+                        remember_processed_transactions(account_id, (txn['transaction_id'] for txn in processed_txns))
+                    
                     if logger:
-                        logger.error(LogCategory.DATABASE, "atomic_cashflow_update", error_msg,
-                                   account_id=account_id, error=error_msg, data=atomic_context)
-                    raise Exception(error_msg)
-                
-                # 2. Insert processed transactions if any
-                if processed_txns:
-                    try:
-                        txn_result = db_client.table('processed_transactions').insert(processed_txns).execute()
-                        if not txn_result.data:
-                            error_msg = f"Failed to insert processed_transactions for account_id {account_id}"
+                        logger.info(LogCategory.DATABASE, "modification_history_saved", 
+                                   "Saved benchmark modification history",
+                                   account_id=account_id,
+                                   data={"modification_id": rpc_result.data, "modification_data": modification_data})
+                except APIError as rpc_error:
+                    # Only a missing function falls back; any other error (constraint violation inside
+                    # the function, timeout after commit) must not repeat the writes non-atomically
+                    if not is_missing_rpc_error(rpc_error):
+                        raise
+                    if logger:
+                        logger.warning(LogCategory.DATABASE, "atomic_cashflow_update_rpc_fallback", 
+                                      f"RPC atomic_cashflow_update not deployed (apply migration 006), using separate calls: {str(rpc_error)}",
+                                      account_id=account_id, error=str(rpc_error))
+                    
+                    # 1. Claim the transactions before the benchmark is touched: if an overlapping run
+                    #    already stored any of them, stop here instead of applying the cashflow twice
+                    if processed_txns:
+                        # Rows already present are skipped by Postgres and not counted as inserted
+                        skipped_count = len(processed_txns) - upsert_processed_transactions(db_client, processed_txns)
+                        remember_processed_transactions(account_id, (txn['transaction_id'] for txn in processed_txns))
+                        if skipped_count > 0:
+                            error_msg = (f"{skipped_count} of {len(processed_txns)} transactions already processed "
+                                         f"for account_id {account_id} - benchmark not adjusted")
                             if logger:
-                                logger.error(LogCategory.DATABASE, "atomic_cashflow_update", error_msg,
+                                logger.error(LogCategory.DATABASE, "duplicate_in_atomic_update", error_msg,
                                            account_id=account_id, error=error_msg, data=atomic_context)
                             raise Exception(error_msg)
-                    except Exception as txn_error:
-                        # Check if it's a duplicate key error
-                        error_msg = str(txn_error)
-                        if 'duplicate key' in error_msg.lower() or 'unique constraint' in error_msg.lower():
+                    
+                    # 2. Save modification history so its id can go out with the config update
+                    modification_id = None
+                    try:
+                        mod_result = db_client.table('benchmark_modifications').insert(modification_data).execute()
+                        if mod_result.data and len(mod_result.data) > 0:
+                            modification_id = mod_result.data[0].get('id')
+                        
                             if logger:
-                                logger.warning(LogCategory.DATABASE, "duplicate_in_atomic_update", 
-                                             f"Duplicate transactions in atomic update, rolling back",
-                                             account_id=account_id, data=atomic_context)
-                        raise  # Always re-raise to trigger rollback
+                                logger.info(LogCategory.DATABASE, "modification_history_saved", 
+                                           "Saved benchmark modification history",
+                                           account_id=account_id,
+                                           data={"modification_id": modification_id, "modification_data": modification_data})
+                    except DB_WRITE_ERRORS as mod_error:
+                        if logger:
+                            logger.error(LogCategory.DATABASE, "modification_history_error", 
+                                       f"Failed to save modification history: {str(mod_error)}",
+                                       account_id=account_id, error=str(mod_error))
+                        # Don't fail the whole transaction if history save fails
                 
-                # 3. Save modification history
-                try:
-                    # Get the modification_id if we need to reference it
-                    mod_result = db_client.table('benchmark_modifications').insert(modification_data).execute()
-                    if mod_result.data and len(mod_result.data) > 0:
-                        modification_id = mod_result.data[0].get('id')
-                        
-                        # Update benchmark_configs with last modification info
-                        db_client.table('benchmark_configs').update({
+                    # 3. Update benchmark config units and last modification info in one round-trip
+                    config_update = dict(update_data)
+                    if modification_id is not None:
+                        config_update.update({
                             'last_modification_type': modification_type,
-                            'last_modification_timestamp': modification_timestamp.isoformat(),
+                            'last_modification_timestamp': modification_ts_iso,
                             'last_modification_amount': net_flow,
                             'last_modification_id': modification_id
-                        }).eq('account_id', account_id).execute()
-                        
+                        })
+                    # Only the affected row count is needed back, not the updated row
+                    config_result = db_client.table('benchmark_configs').update(
+                        config_update, count=CountMethod.exact, returning=ReturnMethod.minimal
+                    ).eq('account_id', account_id).execute()
+                
+                    if not config_result.count:
+                        error_msg = f"Failed to update benchmark_configs for account_id {account_id} - no rows affected"
                         if logger:
-                            logger.info(LogCategory.DATABASE, "modification_history_saved", 
-                                       "Saved benchmark modification history",
-                                       account_id=account_id,
-                                       data={"modification_id": modification_id, "modification_data": modification_data})
-                except Exception as mod_error:
-                    if logger:
-                        logger.error(LogCategory.DATABASE, "modification_history_error", 
-                                   f"Failed to save modification history: {str(mod_error)}",
-                                   account_id=account_id, error=str(mod_error))
-                    # Don't fail the whole transaction if history save fails
+                            logger.error(LogCategory.DATABASE, "atomic_cashflow_update", error_msg,
+                                       account_id=account_id, error=error_msg, data=atomic_context)
+                        raise Exception(error_msg)
                 
-                # 4. Update last processed timestamp
-                update_last_processed_time(db_client, account_id)
+                    # 4. Update last processed timestamp
+                    update_last_processed_time(db_client, account_id, modification_timestamp, logger)
                 
-                if logger:
+                if logger is not None and logger.is_enabled(LogLevel.DEBUG):
                     logger.debug(LogCategory.DATABASE, "atomic_update_success", 
                                "Atomic cashflow update completed successfully",
                                account_id=account_id, data=atomic_context)
                                
             except Exception as db_error:
-                error_context = {**atomic_context, "db_error_type": type(db_error).__name__, "db_error_details": str(db_error)}
                 if logger:
+                    # atomic_context is not used after this point, extend it in place
+                    atomic_context.update({"db_error_type": type(db_error).__name__, "db_error_details": str(db_error)})
                     logger.error(LogCategory.DATABASE, "atomic_cashflow_update", 
                                f"Database atomic operation failed: {str(db_error)}",
-                               account_id=account_id, error=str(db_error), data=error_context)
+                               account_id=account_id, error=str(db_error), data=atomic_context)
                 raise  # Re-raise to trigger rollback in calling function
         
-        # Vrátíme aktualizovaný config
-        updated_config = config.copy()
-        updated_config['btc_units'] = new_btc_units
-        updated_config['eth_units'] = new_eth_units
+        # Vrátíme aktualizovaný config (callers replace their config with the result, no copy needed)
+        config['btc_units'] = new_btc_units
+        config['eth_units'] = new_eth_units
         
         if logger:
             logger.info(LogCategory.TRANSACTION, "benchmark_adjusted", 
@@ -2098,42 +2482,99 @@ def adjust_benchmark_for_cashflow(db_client, config, account_id, net_flow, price
                             "new_btc_units": new_btc_units, "new_eth_units": new_eth_units})
         
         # Benchmark adjusted
-        return updated_config
+        return config
         
     except Exception as e:
-        # Enhanced error context for debugging
-        error_context = {
-            **validation_context,
-            "error_type": type(e).__name__,
-            "error_details": str(e),
-            "current_btc_units": current_btc_units if 'current_btc_units' in locals() else None,
-            "current_eth_units": current_eth_units if 'current_eth_units' in locals() else None,
-            "new_btc_units": new_btc_units if 'new_btc_units' in locals() else None,
-            "new_eth_units": new_eth_units if 'new_eth_units' in locals() else None,
-            "stage": "benchmark_calculation" if 'new_btc_units' not in locals() else "database_update"
-        }
-        
         if logger:
+            # Enhanced error context for debugging (validation_context is not used after this point)
+            error_context = validation_context
+            error_context.update({
+                "error_type": type(e).__name__,
+                "error_details": str(e),
+                "current_btc_units": current_btc_units if 'current_btc_units' in locals() else None,
+                "current_eth_units": current_eth_units if 'current_eth_units' in locals() else None,
+                "new_btc_units": new_btc_units if 'new_btc_units' in locals() else None,
+                "new_eth_units": new_eth_units if 'new_eth_units' in locals() else None,
+                "stage": "benchmark_calculation" if 'new_btc_units' not in locals() else "database_update"
+            })
             logger.error(LogCategory.TRANSACTION, "adjust_benchmark_error", 
                         f"Error adjusting benchmark: {str(e)}",
                         account_id=account_id, error=str(e), data=error_context)
         # Error adjusting benchmark
         raise  # Re-raise aby se celá operace rollbackla
 
-def update_last_processed_time(db_client, account_id):
-    """Aktualizuje timestamp posledního zpracování."""
+def save_processed_transactions(db_client, account_id, processed_txns, logger=None, tick_ts=None):
+    """
+    Uloží zpracované transakce a aktualizuje last_processed_timestamp.
+    Uses the save_processed_transactions RPC (one round-trip, one DB transaction);
+    falls back to upsert + update_last_processed_time if the function is not deployed.
+    """
+    processed_at = tick_ts or datetime.now(UTC)
+    current_time = processed_at.isoformat()
     try:
-        current_time = datetime.now(UTC).isoformat()
+        db_client.rpc('save_processed_transactions', {
+            'p_account_id': str(account_id),
+            'p_txns': processed_txns,
+            'p_processed_at': current_time
+        }).execute()
+        _last_processed_cache[str(account_id)] = (current_time, time.monotonic())
+    except APIError as e:
+        # Only a missing function falls back; other errors may mean the RPC already committed
+        if not is_missing_rpc_error(e):
+            raise
+        if logger:
+            logger.warning(LogCategory.DATABASE, "save_processed_transactions_rpc_fallback", 
+                          f"RPC save_processed_transactions not deployed (apply migration 005), using separate calls: {str(e)}",
+                          account_id=account_id, error=str(e))
+        upsert_processed_transactions(db_client, processed_txns)
+        update_last_processed_time(db_client, account_id, processed_at, logger)
+    
+    remember_processed_transactions(account_id, (txn['transaction_id'] for txn in processed_txns))
+
+def upsert_processed_transactions(db_client, processed_txns):
+    """
+    Non-RPC fallback: upserts processed_transactions in batches of PROCESSED_TRANSACTIONS_BATCH_SIZE.
+    Returns the number of newly inserted rows (duplicates are skipped by Postgres).
+    """
+    inserted = 0
+    for start in range(0, len(processed_txns), PROCESSED_TRANSACTIONS_BATCH_SIZE):
+        result = db_client.table('processed_transactions').upsert(
+            processed_txns[start:start + PROCESSED_TRANSACTIONS_BATCH_SIZE],
+            on_conflict=PROCESSED_TRANSACTIONS_CONFLICT, ignore_duplicates=True,
+            count=CountMethod.exact, returning=ReturnMethod.minimal
+        ).execute()
+        inserted += result.count or 0
+    return inserted
+
+def update_last_processed_time(db_client, account_id, tick_ts=None, logger=None):
+    """
+    Aktualizuje timestamp posledního zpracování.
+    Only used when the save_processed_transactions / atomic_cashflow_update RPCs are not deployed;
+    the RPCs update account_processing_status in the same round-trip.
+    """
+    try:
+        current_time = (tick_ts or datetime.now(UTC)).isoformat()
+        account_key = str(account_id)  # no-op for the UUID strings from binance_accounts
         db_client.table('account_processing_status').upsert({
-            'account_id': str(account_id),  # Ensure it's a string
+            'account_id': account_key,
             'last_processed_timestamp': current_time
-        }).execute()
-    except Exception as e:
-        # Error updating last processed time
-        pass
+        }, returning=ReturnMethod.minimal).execute()
+        _last_processed_cache[account_key] = (current_time, time.monotonic())
+    except DB_WRITE_ERRORS as e:
+        # Not fatal - the next run refetches from the older timestamp and duplicates are skipped
+        if logger:
+            logger.warning(LogCategory.DATABASE, "update_last_processed_error", 
+                          f"Failed to update last processed time: {str(e)}",
+                          account_id=account_id, error=str(e))
 
-def save_history(db_client, account_id, nav, benchmark_value, logger=None, account_name=None, prices=None):
-    timestamp = datetime.now(UTC).isoformat()
+def save_history(db_client, account_id, nav: float, benchmark_value: float, logger=None, account_name=None,
+                 prices: dict[str, float] | None = None, pending_rows=None, timestamp=None):
+    """
+    Uloží NAV a benchmark hodnotu do nav_history.
+    When pending_rows is given the row is appended there and inserted later by save_nav_history_rows.
+    timestamp defaults to now; process_all_accounts passes its tick timestamp.
+    """
+    timestamp = (timestamp or datetime.now(UTC)).isoformat()
     
     # Ceny jsou nyní povinné - bez nich nemůžeme pokračovat
     if not prices or 'BTCUSDT' not in prices or 'ETHUSDT' not in prices:
@@ -2142,18 +2583,22 @@ def save_history(db_client, account_id, nav, benchmark_value, logger=None, accou
             logger.error(LogCategory.DATABASE, "missing_prices", error_msg, account_id=account_id)
         raise ValueError(error_msg)
     
+    # get_comprehensive_nav, calculate_benchmark_value and get_prices already return floats
     history_data = {
         'account_id': str(account_id),  # Ensure it's a string
         'timestamp': timestamp,
-        'nav': float(nav),  # Store as numeric, not string
-        'benchmark_value': float(benchmark_value),
-        'btc_price': float(prices['BTCUSDT']),
-        'eth_price': float(prices['ETHUSDT'])
+        'nav': nav,
+        'benchmark_value': benchmark_value,
+        'btc_price': prices['BTCUSDT'],
+        'eth_price': prices['ETHUSDT']
     }
     
     # Insert data with required price columns
-    with OperationTimer(logger, LogCategory.DATABASE, "insert_nav_history", account_id, account_name) if logger else nullcontext():
-        db_client.table('nav_history').insert(history_data).execute()
+    if pending_rows is not None:
+        pending_rows.append(history_data)
+    else:
+        with OperationTimer(logger, LogCategory.DATABASE, "insert_nav_history", account_id, account_name) if logger else nullcontext():
+            db_client.table('nav_history').insert(history_data).execute()
     
     if logger:
         vs_benchmark = nav - benchmark_value
@@ -2166,6 +2611,33 @@ def save_history(db_client, account_id, nav, benchmark_value, logger=None, accou
     
     # NAV and Benchmark values saved
 
+def save_nav_history_rows(db_client, history_rows, logger=None):
+    """
+    Insert nav_history rows for all accounts in a single call. Failures are logged, not raised.
+    If the batch is rejected, rows are retried one by one so a bad account cannot drop the whole tick.
+    """
+    if not history_rows:
+        return
+    
+    def insert(rows):
+        db_client.table('nav_history').insert(rows).execute()
+    
+    try:
+        with OperationTimer(logger, LogCategory.DATABASE, "insert_nav_history") if logger else nullcontext():
+            _, failed = write_rows_with_row_fallback(insert, history_rows)
+    except DB_WRITE_ERRORS as e:
+        if logger:
+            logger.error(LogCategory.DATABASE, "nav_history_error", 
+                        f"Failed to save NAV history: {str(e)}",
+                        error=str(e), data={"account_ids": [row['account_id'] for row in history_rows]})
+        return
+    
+    if logger:
+        for row, error in failed:
+            logger.error(LogCategory.DATABASE, "nav_history_error", 
+                        f"Failed to save NAV history: {str(error)}",
+                        account_id=row['account_id'], error=str(error))
+
 # Handler is already defined above at line 80
 
 # Tento blok je pro lokální testování, Vercel ho ignoruje
@@ -8,6 +8,7 @@ import json
 import os
 import sys
 import logging
+import threading
 import time
 from datetime import datetime, UTC
 from typing import Dict, List, Any, Optional
@@ -15,6 +16,12 @@ from enum import Enum
 from dataclasses import dataclass, asdict
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    # Fallback to stdlib json if orjson is not installed
+    orjson = None
+
 # Add project root to path for config import
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
@@ -65,6 +72,12 @@ class LogEntry:
     def to_dict(self) -> Dict:
         """Convert to dictionary for JSON serialization."""
         return asdict(self)
+    
+    def to_json(self) -> str:
+        """Serialize to a JSON line; orjson encodes the dataclass directly, without the asdict() deep copy."""
+        if orjson is not None:
+            return orjson.dumps(self, option=orjson.OPT_NON_STR_KEYS).decode()
+        return json.dumps(self.to_dict())
 
 
 class MonitorLogger:
@@ -75,6 +88,9 @@ class MonitorLogger:
         self.max_entries = max_entries
         self.session_id = self._generate_session_id()
         self.logs: List[LogEntry] = []
+        # Accounts are processed on several threads; guards the in-memory buffer and file/DB writes
+        self._lock = threading.Lock()
+        self.min_level = self._resolve_min_level()
         
         # Setup file logging
         self._setup_file_logging()
@@ -82,6 +98,20 @@ class MonitorLogger:
         # Load existing logs
         self._load_existing_logs()
     
+    def _resolve_min_level(self) -> int:
+        """Minimum level from settings.logging.level (everything is logged without config)."""
+        level_name = 'DEBUG'
+        if CONFIG_LOADED:
+            try:
+                level_name = settings.logging.level
+            except AttributeError:
+                pass
+        return getattr(logging, str(level_name).upper(), logging.DEBUG)
+    
+    def is_enabled(self, level: LogLevel) -> bool:
+        """Check whether entries of this level are recorded, so callers can skip building messages/data."""
+        return getattr(logging, level.value) >= self.min_level
+    
     def _generate_session_id(self) -> str:
         """Generate unique session ID."""
         return f"session_{int(time.time())}"
@@ -146,7 +176,7 @@ class MonitorLogger:
             
         try:
             with open(self.file_path, 'a') as f:
-                f.write(json.dumps(entry.to_dict()) + '\n')
+                f.write(entry.to_json() + '\n')
         except Exception as e:
             logging.error(f"Failed to save log entry: {e}")
     
@@ -232,6 +262,8 @@ class MonitorLogger:
             success: bool = True,
             error: Optional[str] = None):
         """Log an event with structured data."""
+        if not self.is_enabled(level):
+            return
         
         entry = LogEntry(
             timestamp=datetime.now(UTC).isoformat(),
@@ -247,15 +279,16 @@ class MonitorLogger:
             error=error
         )
         
-        # Add to memory
-        self.logs.append(entry)
-        
-        # Trim old entries
-        if len(self.logs) > self.max_entries:
-            self.logs = self.logs[-self.max_entries:]
-        
-        # Save to file
-        self._save_log_entry(entry)
+        with self._lock:
+            # Add to memory
+            self.logs.append(entry)
+            
+            # Trim old entries
+            if len(self.logs) > self.max_entries:
+                self.logs = self.logs[-self.max_entries:]
+            
+            # Save to file
+            self._save_log_entry(entry)
         
         # Standard logging
         log_level = getattr(logging, level.value)
@@ -303,7 +336,7 @@ class MonitorLogger:
         error_logs = []
         for log in self.logs:
             try:
-                log_time = datetime.fromisoformat(log.timestamp.replace('Z', '+00:00')).timestamp()
+                log_time = datetime.fromisoformat(log.timestamp).timestamp()
                 if log_time >= cutoff_time and not log.success:
                     error_logs.append(log.to_dict())
             except Exception:
@@ -23,11 +23,11 @@ def get_sub_account_transfers(api_key, api_secret, email=None, start_time=None,
     Returns:
         List of transfer transactions
     """
-    from binance.client import Client
+    from api.binance_client import MonitorBinanceClient
     
     try:
         # Create Binance client
-        client = Client(api_key, api_secret)
+        client = MonitorBinanceClient(api_key, api_secret, ping=False)
         
         # Build parameters
         params = {}
@@ -47,6 +47,8 @@ class SchedulingConfig:
     historical_period_days: int
     max_historical_period_days: int
     thread_join_timeout_seconds: int
+    # Skip the transaction fetch for warm re-invocations only; keep below the shortest cron/daemon interval
+    min_poll_interval_seconds: int = 15
 
 @dataclass
 class FinancialConfig:
@@ -124,7 +126,8 @@ class Settings:
             log_retention_entries=sched_config.get("log_retention_entries", 10000),
             historical_period_days=sched_config.get("historical_period_days", 30),
             max_historical_period_days=sched_config.get("max_historical_period_days", 365),
-            thread_join_timeout_seconds=sched_config.get("thread_join_timeout_seconds", 5)
+            thread_join_timeout_seconds=sched_config.get("thread_join_timeout_seconds", 5),
+            min_poll_interval_seconds=sched_config.get("min_poll_interval_seconds", 15)
         )
         
         # Financial configuration
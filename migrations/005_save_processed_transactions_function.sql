@@ -0,0 +1,28 @@
+-- Migration: Create save_processed_transactions function
+-- Purpose: Save processed deposits/withdrawals and bump account_processing_status
+--          in one round-trip and one transaction (used when there is no net cashflow)
+-- Date: 2025-08-05
+
+CREATE OR REPLACE FUNCTION save_processed_transactions(
+    p_account_id UUID,
+    p_txns JSONB,
+    p_processed_at TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO processed_transactions (account_id, transaction_id, type, amount, timestamp, status, metadata)
+    SELECT account_id, transaction_id, type, amount, timestamp, status, metadata
+    FROM jsonb_populate_recordset(NULL::processed_transactions, p_txns)
+    ON CONFLICT (account_id, transaction_id) DO NOTHING;
+
+    INSERT INTO account_processing_status (account_id, last_processed_timestamp)
+    VALUES (p_account_id, p_processed_at)
+    ON CONFLICT (account_id) DO UPDATE
+    SET last_processed_timestamp = EXCLUDED.last_processed_timestamp;
+END;
+$$;
+
+COMMENT ON FUNCTION save_processed_transactions(UUID, JSONB, TIMESTAMPTZ) IS
+'Atomically stores processed transactions (duplicates ignored) and updates last_processed_timestamp';
@@ -0,0 +1,74 @@
+-- Migration: Create atomic_cashflow_update function
+-- Purpose: Apply a deposit/withdrawal benchmark adjustment in one round-trip and one transaction:
+--          modification history, benchmark units + last modification info, processed transactions
+--          and account_processing_status
+-- Date: 2025-08-06
+
+CREATE OR REPLACE FUNCTION atomic_cashflow_update(
+    p_account_id UUID,
+    p_btc_units NUMERIC,
+    p_eth_units NUMERIC,
+    p_modification JSONB,
+    p_txns JSONB,
+    p_processed_at TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_modification_id BIGINT;
+    v_inserted INTEGER;
+BEGIN
+    -- Claim the transactions first: if an overlapping run (manual trigger + cron, daemon) already
+    -- stored any of them, abort before the benchmark is adjusted a second time for the same cashflow
+    IF p_txns IS NOT NULL AND jsonb_array_length(p_txns) > 0 THEN
+        INSERT INTO processed_transactions (account_id, transaction_id, type, amount, timestamp, status, metadata)
+        SELECT account_id, transaction_id, type, amount, timestamp, status, metadata
+        FROM jsonb_populate_recordset(NULL::processed_transactions, p_txns)
+        ON CONFLICT (account_id, transaction_id) DO NOTHING;
+
+        GET DIAGNOSTICS v_inserted = ROW_COUNT;
+        IF v_inserted <> jsonb_array_length(p_txns) THEN
+            RAISE EXCEPTION '% of % transactions already processed for account_id %',
+                jsonb_array_length(p_txns) - v_inserted, jsonb_array_length(p_txns), p_account_id
+                USING ERRCODE = 'unique_violation';
+        END IF;
+    END IF;
+
+    INSERT INTO benchmark_modifications (
+        account_id, modification_timestamp, modification_type,
+        btc_units_before, eth_units_before, cashflow_amount, btc_price, eth_price,
+        btc_allocation, eth_allocation, btc_units_bought, eth_units_bought,
+        btc_units_after, eth_units_after, transaction_id, transaction_type
+    )
+    SELECT account_id, modification_timestamp, modification_type,
+           btc_units_before, eth_units_before, cashflow_amount, btc_price, eth_price,
+           btc_allocation, eth_allocation, btc_units_bought, eth_units_bought,
+           btc_units_after, eth_units_after, transaction_id, transaction_type
+    FROM jsonb_populate_record(NULL::benchmark_modifications, p_modification)
+    RETURNING id INTO v_modification_id;
+
+    UPDATE benchmark_configs
+    SET btc_units = p_btc_units,
+        eth_units = p_eth_units,
+        last_modification_type = p_modification->>'modification_type',
+        last_modification_timestamp = (p_modification->>'modification_timestamp')::TIMESTAMPTZ,
+        last_modification_amount = (p_modification->>'cashflow_amount')::NUMERIC,
+        last_modification_id = v_modification_id
+    WHERE account_id = p_account_id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'benchmark_configs row not found for account_id %', p_account_id;
+    END IF;
+
+    INSERT INTO account_processing_status (account_id, last_processed_timestamp)
+    VALUES (p_account_id, p_processed_at)
+    ON CONFLICT (account_id) DO UPDATE
+    SET last_processed_timestamp = EXCLUDED.last_processed_timestamp;
+
+    RETURN v_modification_id;
+END;
+$$;
+
+COMMENT ON FUNCTION atomic_cashflow_update(UUID, NUMERIC, NUMERIC, JSONB, JSONB, TIMESTAMPTZ) IS
+'Atomically records a benchmark modification, updates benchmark units and last modification info, stores processed transactions and updates last_processed_timestamp. Raises (rolling everything back) if any transaction was already processed';
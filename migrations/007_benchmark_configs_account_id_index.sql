@@ -0,0 +1,26 @@
+-- Migration: Ensure benchmark_configs(account_id) is unique
+-- Purpose: The documented schema (docs/DATABASE_SCHEMA.md) declares benchmark_configs.account_id UNIQUE,
+--          which already provides the index used by the binance_accounts -> benchmark_configs embed,
+--          per-account updates and the batched rebalance upsert (on_conflict='account_id').
+--          This migration only adds the index on databases created without that constraint;
+--          where it exists, nothing is changed (no redundant second index).
+-- Date: 2025-08-07
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'benchmark_configs'::regclass
+          AND i.indisunique
+          AND i.indnkeyatts = 1
+          AND a.attname = 'account_id'
+    ) THEN
+        -- Fails if an account has more than one config row; remove the duplicates first
+        CREATE UNIQUE INDEX idx_benchmark_configs_account_id ON benchmark_configs(account_id);
+    END IF;
+END $$;
+
+-- Verify: exactly one unique index on account_id
+-- SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'benchmark_configs';
@@ -66,7 +66,7 @@ def process_master_account_transfers(master_account, db_client, logger, binance_
         
         if last_processed_response.data:
             last_processed = last_processed_response.data[0]['last_processed_timestamp']
-            start_time = int(datetime.fromisoformat(last_processed.replace('Z', '+00:00')).timestamp() * 1000)
+            start_time = int(datetime.fromisoformat(last_processed).timestamp() * 1000)
         else:
             # Default to 30 days ago
             start_time = int((datetime.now(timezone.utc) - timedelta(days=30)).timestamp() * 1000)
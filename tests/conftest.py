@@ -23,6 +23,7 @@ def mock_supabase_client():
     mock_table.update.return_value = mock_table
     mock_table.upsert.return_value = mock_table
     mock_table.eq.return_value = mock_table
+    mock_table.maybe_single.return_value = mock_table
     mock_table.execute.return_value = Mock(data=[])
     
     return mock_client
@@ -117,4 +118,14 @@ def benchmark_config():
 @pytest.fixture
 def current_time():
     """Fixed current time for testing."""
-    return datetime(2025, 7, 2, 12, 0, 0, tzinfo=UTC)
\ No newline at end of file
+    return datetime(2025, 7, 2, 12, 0, 0, tzinfo=UTC)
+
+@pytest.fixture(autouse=True)
+def clear_transaction_caches():
+    """Reset the in-process transaction caches between tests."""
+    from api.index import _processed_id_cache, _last_processed_cache
+    _processed_id_cache.clear()
+    _last_processed_cache.clear()
+    yield
+    _processed_id_cache.clear()
+    _last_processed_cache.clear()
@@ -1,16 +1,34 @@
 """
 Unit tests for API integration functions (Binance API, price fetching, NAV calculation).
 """
+import httpx
 import pytest
 from unittest.mock import Mock, patch, MagicMock
+from datetime import datetime, timedelta, UTC
 from binance.exceptions import BinanceAPIException
+from postgrest import APIError
 
 # Import functions from our API
 from api.index import (
     get_prices,
+    get_ticker_prices,
+    get_asset_usd_price,
+    get_symbol_price,
+    get_comprehensive_nav,
     get_futures_account_nav,
     fetch_new_transactions,
-    process_deposits_withdrawals
+    process_deposits_withdrawals,
+    filter_unprocessed_transactions,
+    remember_processed_transactions,
+    known_processed_transactions,
+    get_last_processed_time,
+    update_last_processed_time,
+    upsert_processed_transactions,
+    validate_transaction_inputs,
+    save_history,
+    save_nav_history_rows,
+    Txn,
+    _ticker_price_cache
 )
 
 
@@ -59,6 +77,169 @@ class TestGetPrices:
         assert result is None
 
 
+    def test_get_prices_from_tickers(self, mock_binance_client):
+        """Test that a prefetched tickers map replaces the per-symbol calls."""
+        tickers = {'BTCUSDT': 66000.0, 'ETHUSDT': 3600.0, 'BNBUSDT': 600.0}
+        
+        result = get_prices(mock_binance_client, tickers=tickers)
+        
+        assert result == {'BTCUSDT': 66000.0, 'ETHUSDT': 3600.0}
+        mock_binance_client.get_symbol_ticker.assert_not_called()
+
+
+class TestGetTickerPrices:
+    """Test the get_ticker_prices batch lookup."""
+    
+    def test_builds_symbol_map(self):
+        """Test that all tickers come back as floats keyed by symbol."""
+        mock_client = Mock()
+        mock_client.get_all_tickers.return_value = [
+            {'symbol': 'BTCUSDT', 'price': '65000.00'},
+            {'symbol': 'XYZBTC', 'price': '0.001'}
+        ]
+        
+        assert get_ticker_prices(mock_client) == {'BTCUSDT': 65000.0, 'XYZBTC': 0.001}
+        mock_client.get_all_tickers.assert_called_once()
+    
+    def test_error_returns_none(self):
+        """Test that a failed batch call lets callers fall back to single tickers."""
+        mock_client = Mock()
+        mock_client.get_all_tickers.side_effect = httpx.ConnectError("down")
+        
+        assert get_ticker_prices(mock_client) is None
+
+
+class TestGetSymbolPrice:
+    """Test the TTL-cached single ticker lookup."""
+    
+    def setup_method(self):
+        _ticker_price_cache.clear()
+    
+    def test_repeated_lookup_hits_cache(self, mock_binance_client):
+        """Test that the same symbol is fetched once within the TTL."""
+        assert get_symbol_price(mock_binance_client, 'BTCUSDT') == 65000.0
+        assert get_symbol_price(mock_binance_client, 'BTCUSDT') == 65000.0
+        
+        mock_binance_client.get_symbol_ticker.assert_called_once_with(symbol='BTCUSDT')
+    
+    def test_expired_entry_is_refetched(self, mock_binance_client):
+        """Test that entries older than the TTL are fetched again."""
+        with patch('api.index.time.monotonic', side_effect=[0.0, 100.0, 100.0]):
+            get_symbol_price(mock_binance_client, 'ETHUSDT')
+            get_symbol_price(mock_binance_client, 'ETHUSDT')
+        
+        assert mock_binance_client.get_symbol_ticker.call_count == 2
+
+
+class TestGetAssetUsdPrice:
+    """Test the get_asset_usd_price helper used by NAV calculation."""
+    
+    def setup_method(self):
+        _ticker_price_cache.clear()
+    
+    def test_stablecoin_skips_api(self, mock_binance_client):
+        """Test that stablecoins are priced at 1.0 without a ticker call."""
+        result = get_asset_usd_price(mock_binance_client, 'USDT', 65000.0, frozenset({'USDT'}))
+        
+        assert result == 1.0
+        mock_binance_client.get_symbol_ticker.assert_not_called()
+    
+    def test_falls_back_to_btc_pair(self):
+        """Test BTC routing when the USDT pair does not exist."""
+        mock_client = Mock()
+        mock_response = Mock()
+        mock_response.text = '{"code": -1121, "msg": "Invalid symbol."}'
+        
+        def ticker(symbol):
+            if symbol == 'XYZUSDT':
+                raise BinanceAPIException(mock_response, 400, mock_response.text)
+            return {'price': '0.001'}
+        mock_client.get_symbol_ticker.side_effect = ticker
+        
+        assert get_asset_usd_price(mock_client, 'XYZ', 65000.0, frozenset()) == 65.0
+        assert get_asset_usd_price(mock_client, 'XYZ', 65000.0, frozenset(), via_btc=False) == 0.0
+    
+    def test_uses_tickers_map(self, mock_binance_client):
+        """Test pricing from the shared tickers map without API calls."""
+        tickers = {'BNBUSDT': 600.0, 'XYZBTC': 0.001}
+        
+        assert get_asset_usd_price(mock_binance_client, 'BNB', 65000.0, frozenset(), tickers=tickers) == 600.0
+        assert get_asset_usd_price(mock_binance_client, 'XYZ', 65000.0, frozenset(), tickers=tickers) == 65.0
+        assert get_asset_usd_price(mock_binance_client, 'XYZ', 65000.0, frozenset(), via_btc=False,
+                                   tickers=tickers) == 0.0
+        assert get_asset_usd_price(mock_binance_client, 'ABC', 65000.0, frozenset(), tickers=tickers) == 0.0
+        mock_binance_client.get_symbol_ticker.assert_not_called()
+    
+    def test_unexpected_error_propagates(self):
+        """Test that programming errors are no longer swallowed."""
+        mock_client = Mock()
+        mock_client.get_symbol_ticker.side_effect = RuntimeError("bug")
+        
+        with pytest.raises(RuntimeError):
+            get_asset_usd_price(mock_client, 'XYZ', 65000.0, frozenset())
+
+
+class TestGetComprehensiveNav:
+    """Test the get_comprehensive_nav wallet aggregation."""
+    
+    def make_client(self):
+        mock_client = Mock()
+        mock_client.get_account.return_value = {'balances': [
+            {'asset': 'USDT', 'free': '1000.0', 'locked': '0.0'},
+            {'asset': 'BTC', 'free': '0.1', 'locked': '0.0'}
+        ]}
+        mock_client.futures_account.return_value = {'assets': [
+            {'asset': 'USDT', 'walletBalance': '500.0', 'unrealizedProfit': '50.0', 'marginBalance': '550.0'}
+        ]}
+        mock_client.funding_wallet.return_value = []
+        mock_client._request.return_value = {'rows': [{'asset': 'ETH', 'totalAmount': '1.0'}]}
+        mock_client.get_staking_position.return_value = []
+        return mock_client
+    
+    def test_sums_all_wallets(self):
+        """Test that every wallet is fetched once and included in the NAV."""
+        mock_client = self.make_client()
+        tickers = {'BTCUSDT': 65000.0, 'ETHUSDT': 3500.0}
+        
+        nav = get_comprehensive_nav(mock_client, prices={'BTCUSDT': 65000.0}, tickers=tickers)
+        
+        # 1000 + 0.1 * 65000 + 550 + 1 * 3500
+        assert nav == pytest.approx(11550.0)
+        mock_client.get_account.assert_called_once()
+        mock_client.futures_account.assert_called_once()
+        mock_client.funding_wallet.assert_called_once_with(needBtcValuation='true')
+        mock_client.get_staking_position.assert_called_once_with(product='STAKING')
+
+    def test_funding_missing_fields_count_as_zero(self):
+        """Test that funding rows without freeze/withdrawing are still counted."""
+        mock_client = self.make_client()
+        mock_client.funding_wallet.return_value = [
+            {'asset': 'ETH', 'free': '2.0', 'locked': '0.5'}
+        ]
+        tickers = {'BTCUSDT': 65000.0, 'ETHUSDT': 3500.0}
+
+        nav = get_comprehensive_nav(mock_client, prices={'BTCUSDT': 65000.0}, tickers=tickers)
+
+        # 11550 + 2.5 * 3500
+        assert nav == pytest.approx(20300.0)
+
+    def test_optional_wallet_error_is_skipped(self):
+        """Test that a failing earn endpoint does not fail the whole NAV."""
+        mock_client = self.make_client()
+        mock_client._request.side_effect = httpx.ReadTimeout("slow")
+        
+        nav = get_comprehensive_nav(mock_client, prices={'BTCUSDT': 65000.0}, tickers={})
+        
+        assert nav == pytest.approx(8050.0)
+    
+    def test_spot_error_returns_none(self):
+        """Test that a spot account failure still fails the NAV."""
+        mock_client = self.make_client()
+        mock_client.get_account.side_effect = httpx.ConnectError("down")
+        
+        assert get_comprehensive_nav(mock_client, prices={'BTCUSDT': 65000.0}, tickers={}) is None
+
+
 class TestGetFuturesAccountNav:
     """Test the get_futures_account_nav function."""
     
@@ -224,6 +405,314 @@ class TestFetchNewTransactions:
         # Should only return the successful transaction
         assert len(result) == 1
         assert result[0]['id'] == 'DEP_12345'
+    
+    @patch('api.index.get_pay_transactions')
+    def test_fetch_transactions_partial_endpoint_failure(self, mock_get_pay):
+        """Test that a failing endpoint does not drop results fetched concurrently."""
+        mock_get_pay.return_value = []
+        mock_client = Mock()
+        mock_client.get_deposit_history.return_value = [
+            {
+                'txId': '12345',
+                'amount': '100.00',
+                'coin': 'USDT',
+                'insertTime': 1751450400000,
+                'status': 1
+            }
+        ]
+        mock_client.get_withdraw_history.side_effect = Exception("Withdrawal endpoint down")
+        
+        result = fetch_new_transactions(mock_client, '2025-07-01T12:00:00+00:00')
+        
+        assert len(result) == 1
+        assert result[0]['id'] == 'DEP_12345'
+        assert result[0]['metadata']['usd_value'] == 100.0
+        mock_get_pay.assert_called_once()
+        # Pay history is filtered server-side from the same start time
+        assert mock_get_pay.call_args[1]['start_time'] == 1751371200000
+    
+    @patch('api.index.get_pay_transactions')
+    def test_fetch_transactions_prices_each_coin_once(self, mock_get_pay):
+        """Test that repeated deposits of one coin share a single price lookup."""
+        mock_get_pay.return_value = []
+        mock_client = Mock()
+        mock_client.get_deposit_history.return_value = [
+            {'txId': str(i), 'amount': '2.0', 'coin': 'SOL', 'insertTime': 1751450400000 + i, 'status': 1}
+            for i in range(3)
+        ]
+        mock_client.get_withdraw_history.return_value = []
+        mock_client.get_symbol_ticker.return_value = {'symbol': 'SOLUSDT', 'price': '150.00'}
+        
+        result = fetch_new_transactions(mock_client, '2025-07-01T12:00:00+00:00', prices={'BTCUSDT': 65000.0})
+        
+        assert len(result) == 3
+        assert all(txn['metadata']['usd_value'] == 300.0 for txn in result)
+        mock_client.get_symbol_ticker.assert_called_once_with(symbol='SOLUSDT')
+    
+    @patch('api.index.get_pay_transactions')
+    def test_fetch_transactions_completed_withdrawal_sorted(self, mock_get_pay):
+        """Test that completed withdrawals (status 6) are kept, get metadata and are sorted by time."""
+        mock_get_pay.return_value = []
+        mock_client = Mock()
+        mock_client.get_deposit_history.return_value = [
+            {'txId': '1', 'amount': '10.0', 'coin': 'USDT', 'insertTime': 1751450500000, 'status': 1}
+        ]
+        mock_client.get_withdraw_history.return_value = [
+            {'id': 'w1', 'amount': '5.0', 'coin': 'USDT', 'applyTime': 1751450400000, 'status': 6,
+             'transferType': 0, 'info': '', 'withdrawOrderDescription': ''},
+            {'id': 'w2', 'amount': '7.0', 'coin': 'USDT', 'applyTime': 1751450400000, 'status': 4}
+        ]
+        
+        result = fetch_new_transactions(mock_client, '2025-07-01T12:00:00+00:00')
+        
+        assert [txn['id'] for txn in result] == ['WD_w1', 'DEP_1']
+        assert result[0]['status'] == 'SUCCESS'
+        assert result[0]['metadata']['coin'] == 'USDT'
+        assert 'coin' not in result[0]
+    
+    @patch('api.index.get_pay_transactions')
+    def test_fetch_transactions_fee_withdrawal_detected(self, mock_get_pay):
+        """Test that fee keywords in the withdrawal description mark a FEE_WITHDRAWAL."""
+        mock_get_pay.return_value = []
+        mock_client = Mock()
+        mock_client.get_deposit_history.return_value = []
+        mock_client.get_withdraw_history.return_value = [
+            {'id': 'w1', 'amount': '5.0', 'coin': 'USDT', 'applyTime': 1751450400000, 'status': 6,
+             'info': '', 'withdrawOrderDescription': 'Q2 Performance payout'},
+            {'id': 'w2', 'amount': '7.0', 'coin': 'USDT', 'applyTime': 1751450500000, 'status': 6,
+             'info': 'to cold wallet', 'withdrawOrderDescription': ''}
+        ]
+        
+        result = fetch_new_transactions(mock_client, '2025-07-01T12:00:00+00:00')
+        
+        assert [txn['type'] for txn in result] == ['FEE_WITHDRAWAL', 'WITHDRAWAL']
+
+    @patch('api.index.get_pay_transactions')
+    def test_fetch_transactions_cancelled_withdrawal_skipped(self, mock_get_pay):
+        """Test that withdrawal status 1 (Cancelled) is not treated like a successful deposit."""
+        mock_get_pay.return_value = []
+        mock_client = Mock()
+        mock_client.get_deposit_history.return_value = []
+        mock_client.get_withdraw_history.return_value = [
+            {'id': 'w1', 'amount': '5.0', 'coin': 'USDT', 'applyTime': 1751450400000, 'status': 1},
+            {'id': 'w2', 'amount': '7.0', 'coin': 'USDT', 'applyTime': 1751450500000, 'status': 6}
+        ]
+
+        result = fetch_new_transactions(mock_client, '2025-07-01T12:00:00+00:00')
+
+        assert [txn['id'] for txn in result] == ['WD_w2']
+
+    @patch('api.index.get_pay_transactions')
+    def test_fetch_transactions_pending_skip_price_lookup(self, mock_get_pay):
+        """Test that pending deposits are dropped before any USD price lookup."""
+        mock_get_pay.return_value = []
+        mock_client = Mock()
+        mock_client.get_deposit_history.return_value = [
+            {'txId': '1', 'amount': '2.0', 'coin': 'SOL', 'insertTime': 1751450400000, 'status': 0}
+        ]
+        mock_client.get_withdraw_history.return_value = [
+            {'id': 'w1', 'amount': '5.0', 'coin': 'USDT', 'applyTime': 1751450400000, 'status': 4}
+        ]
+        
+        result = fetch_new_transactions(mock_client, '2025-07-01T12:00:00+00:00', prices={'BTCUSDT': 65000.0})
+        
+        assert result == []
+        mock_client.get_symbol_ticker.assert_not_called()
+
+
+class TestTxn:
+    """Test the Txn transaction record."""
+    
+    def test_from_dict_parses_amount_once(self):
+        """Test that the raw Binance amount string is converted to float."""
+        txn = Txn.from_dict({
+            'id': 'DEP_12345',
+            'type': 'DEPOSIT',
+            'amount': '1000.00',
+            'timestamp': '2025-07-02T10:00:00+00:00',
+            'status': 'SUCCESS',
+            'metadata': {'coin': 'USDT'}
+        })
+        
+        assert txn.amount == 1000.0
+        assert txn.type == 'DEPOSIT'
+        assert txn.metadata == {'coin': 'USDT'}
+        assert not hasattr(txn, '__dict__')
+    
+    def test_from_dict_missing_optional_fields(self):
+        """Test defaults for transactions without type or metadata."""
+        txn = Txn.from_dict({'id': 'X', 'timestamp': '2025-07-02T10:00:00+00:00', 'status': 'SUCCESS'})
+        
+        assert txn.type == ''
+        assert txn.amount == 0.0
+        assert txn.metadata is None
+
+
+class TestFilterUnprocessedTransactions:
+    """Test the filter_unprocessed_transactions function."""
+    
+    def _txn(self, txn_id):
+        return Txn(id=txn_id, type='DEPOSIT', status='SUCCESS', amount=100.0,
+                   timestamp='2025-07-02T10:00:00+00:00')
+    
+    def test_filter_queries_db_and_caches_existing(self, mock_supabase_client):
+        """Test that IDs found in the DB are remembered for the next run."""
+        mock_table = mock_supabase_client.table.return_value
+        mock_table.in_.return_value = mock_table
+        mock_table.execute.return_value = Mock(data=[{'transaction_id': 'DEP_1'}])
+        
+        result = filter_unprocessed_transactions(
+            mock_supabase_client, [self._txn('DEP_1'), self._txn('DEP_2')], 1
+        )
+        
+        assert [txn.id for txn in result] == ['DEP_2']
+        
+        # Second run with only the known transaction does not touch the DB
+        mock_supabase_client.reset_mock()
+        result = filter_unprocessed_transactions(mock_supabase_client, [self._txn('DEP_1')], 1)
+        
+        assert result == []
+        mock_supabase_client.table.assert_not_called()
+    
+    @patch('api.index.PROCESSED_ID_LOOKUP_BATCH_SIZE', 2)
+    def test_filter_looks_up_ids_in_batches(self, mock_supabase_client):
+        """Test that the in_() lookup is split so the query string stays bounded."""
+        mock_table = mock_supabase_client.table.return_value
+        mock_table.in_.return_value = mock_table
+        mock_table.execute.side_effect = [Mock(data=[{'transaction_id': 'DEP_1'}]),
+                                          Mock(data=[{'transaction_id': 'DEP_4'}])]
+        
+        result = filter_unprocessed_transactions(
+            mock_supabase_client, [self._txn(f'DEP_{i}') for i in range(1, 5)], 1
+        )
+        
+        assert [txn.id for txn in result] == ['DEP_2', 'DEP_3']
+        assert [c[0][1] for c in mock_table.in_.call_args_list] == [['DEP_1', 'DEP_2'], ['DEP_3', 'DEP_4']]
+    
+    def test_filter_skips_db_when_all_cached(self, mock_supabase_client):
+        """Test that cached IDs are filtered without a Supabase round-trip."""
+        remember_processed_transactions(1, ['DEP_1', 'WD_2'])
+        
+        result = filter_unprocessed_transactions(
+            mock_supabase_client, [self._txn('DEP_1'), self._txn('WD_2')], 1
+        )
+        
+        assert result == []
+        mock_supabase_client.table.assert_not_called()
+    
+    @patch('api.index.PROCESSED_ID_CACHE_MAX_PER_ACCOUNT', 3)
+    def test_cache_keeps_most_recent_ids(self):
+        """Test that the per-account cache is capped to the most recently seen IDs."""
+        remember_processed_transactions(1, ['DEP_1', 'DEP_2', 'DEP_3'])
+        remember_processed_transactions(1, ['DEP_1', 'DEP_4'])
+        
+        assert list(known_processed_transactions(1)) == ['DEP_3', 'DEP_1', 'DEP_4']
+    
+    @patch('api.index.time.monotonic')
+    def test_cache_expires_after_ttl(self, mock_monotonic, mock_supabase_client):
+        """Test that rows deleted for reprocessing are looked up again once the entry expires."""
+        mock_monotonic.return_value = 0.0
+        remember_processed_transactions(1, ['DEP_1'])
+        mock_monotonic.return_value = 301.0
+        mock_table = mock_supabase_client.table.return_value
+        mock_table.in_.return_value = mock_table
+        mock_table.execute.return_value = Mock(data=[])
+        
+        result = filter_unprocessed_transactions(mock_supabase_client, [self._txn('DEP_1')], 1)
+        
+        assert [txn.id for txn in result] == ['DEP_1']
+        mock_table.in_.assert_called_once()
+
+
+class TestUpsertProcessedTransactions:
+    """Test the upsert_processed_transactions fallback."""
+    
+    @patch('api.index.PROCESSED_TRANSACTIONS_BATCH_SIZE', 2)
+    def test_upsert_in_batches_and_counts_inserted(self, mock_supabase_client):
+        """Test that rows are upserted in bounded batches and inserted counts are summed."""
+        upsert = mock_supabase_client.table().upsert
+        upsert.return_value.execute.side_effect = [Mock(count=2), Mock(count=0), Mock(count=None)]
+        rows = [{'account_id': 1, 'transaction_id': f'DEP_{i}'} for i in range(5)]
+        
+        inserted = upsert_processed_transactions(mock_supabase_client, rows)
+        
+        assert inserted == 2
+        assert [len(c[0][0]) for c in upsert.call_args_list] == [2, 2, 1]
+
+
+class TestLastProcessedTime:
+    """Test caching of the last processed timestamp."""
+    
+    def test_get_last_processed_time_cached(self, mock_supabase_client):
+        """Test that a second lookup is served without a DB query."""
+        mock_supabase_client.table().execute.return_value = Mock(
+            data={'last_processed_timestamp': '2025-07-02T10:00:00+00:00'}
+        )
+        mock_supabase_client.table.reset_mock()
+        
+        first = get_last_processed_time(mock_supabase_client, 1)
+        second = get_last_processed_time(mock_supabase_client, 1)
+        
+        assert first == second == '2025-07-02T10:00:00+00:00'
+        assert mock_supabase_client.table.call_count == 1
+    
+    def test_get_last_processed_time_no_status_row(self, mock_supabase_client):
+        """Test the first-run fallback when maybe_single() finds no row."""
+        mock_supabase_client.table().execute.return_value = None
+        
+        result = get_last_processed_time(mock_supabase_client, 1)
+        
+        assert datetime.fromisoformat(result) < datetime.now(UTC)
+        mock_supabase_client.table().maybe_single.assert_called()
+    
+    def test_update_last_processed_time_writes_through(self, mock_supabase_client):
+        """Test that the updated timestamp is returned without re-reading the DB."""
+        update_last_processed_time(mock_supabase_client, 1)
+        written = mock_supabase_client.table().upsert.call_args[0][0]['last_processed_timestamp']
+        mock_supabase_client.table.reset_mock()
+        
+        assert get_last_processed_time(mock_supabase_client, 1) == written
+        mock_supabase_client.table.assert_not_called()
+    
+    def test_update_last_processed_time_uses_tick_timestamp(self, mock_supabase_client):
+        """Test that a passed tick timestamp is stored instead of the current time."""
+        tick_ts = datetime(2025, 7, 2, 10, 0, 0, tzinfo=UTC)
+        
+        update_last_processed_time(mock_supabase_client, 1, tick_ts)
+        
+        written = mock_supabase_client.table().upsert.call_args[0][0]['last_processed_timestamp']
+        assert written == '2025-07-02T10:00:00+00:00'
+    
+    def test_update_last_processed_time_logs_failure(self, mock_supabase_client):
+        """Test that a failed status upsert is logged instead of silently ignored."""
+        mock_supabase_client.table().upsert.side_effect = httpx.ConnectError("connection reset")
+        logger = Mock()
+        
+        update_last_processed_time(mock_supabase_client, 1, logger=logger)
+        
+        logger.warning.assert_called_once()
+        assert logger.warning.call_args[0][1] == 'update_last_processed_error'
+
+
+class TestValidateTransactionInputs:
+    """Test the validate_transaction_inputs function."""
+    
+    def test_valid_inputs_skip_error_logging(self, benchmark_config, sample_prices):
+        """Test that valid inputs pass without building an error entry."""
+        logger = Mock()
+        
+        assert validate_transaction_inputs(1, benchmark_config, sample_prices, logger) is True
+        logger.error.assert_not_called()
+    
+    def test_invalid_inputs_log_each_error(self, benchmark_config):
+        """Test that failures still report every problem found."""
+        logger = Mock()
+        config = dict(benchmark_config, eth_units=None)
+        
+        assert validate_transaction_inputs(1, config, {'BTCUSDT': 0}, logger) is False
+        errors = logger.error.call_args[1]['data']['validation_errors']
+        assert errors == ['Config key eth_units is None', 'Invalid price value for BTCUSDT: 0',
+                          'Missing price for ETHUSDT']
 
 
 class TestProcessDepositsWithdrawals:
@@ -275,6 +764,147 @@ class TestProcessDepositsWithdrawals:
         assert call_args[2] == 1  # account_id
         assert call_args[3] == 500.0  # net_flow (1000 deposit - 500 withdrawal)
     
+    @patch('api.index.update_last_processed_time')
+    @patch('api.index.get_last_processed_time')
+    @patch('api.index.fetch_new_transactions')
+    def test_process_zero_net_flow_upserts_ignoring_duplicates(self, mock_fetch, mock_get_time, mock_update_time,
+                                                               mock_supabase_client, mock_binance_client,
+                                                               benchmark_config, sample_prices):
+        """Test the upsert fallback when the save_processed_transactions RPC is not deployed."""
+        mock_get_time.return_value = '2025-07-01T12:00:00+00:00'
+        mock_supabase_client.rpc.side_effect = APIError({'code': 'PGRST202', 'message': 'Could not find the function'})
+        mock_supabase_client.table().upsert.return_value.execute.return_value = Mock(count=2)
+        mock_fetch.return_value = [
+            {'id': 'DEP_1', 'type': 'DEPOSIT', 'amount': 500.0,
+             'timestamp': '2025-07-02T10:00:00+00:00', 'status': 'SUCCESS'},
+            {'id': 'WD_2', 'type': 'WITHDRAWAL', 'amount': 500.0,
+             'timestamp': '2025-07-02T11:00:00+00:00', 'status': 'SUCCESS'}
+        ]
+        
+        result = process_deposits_withdrawals(
+            mock_supabase_client, mock_binance_client, 1, benchmark_config, sample_prices
+        )
+        
+        assert result == benchmark_config
+        upsert = mock_supabase_client.table().upsert
+        upsert.assert_called_once()
+        assert [row['transaction_id'] for row in upsert.call_args[0][0]] == ['DEP_1', 'WD_2']
+        assert upsert.call_args[1] == {'on_conflict': 'account_id,transaction_id', 'ignore_duplicates': True,
+                                       'count': 'exact', 'returning': 'minimal'}
+        mock_supabase_client.table().insert.assert_not_called()
+        mock_update_time.assert_called_once()
+        assert mock_update_time.call_args[0][:2] == (mock_supabase_client, 1)
+    
+    @patch('api.index.update_last_processed_time')
+    @patch('api.index.get_last_processed_time')
+    @patch('api.index.fetch_new_transactions')
+    def test_process_zero_net_flow_rpc_timeout_no_fallback(self, mock_fetch, mock_get_time, mock_update_time,
+                                                           mock_supabase_client, mock_binance_client,
+                                                           benchmark_config, sample_prices):
+        """Test that an RPC failure other than a missing function is not retried as separate writes."""
+        mock_get_time.return_value = '2025-07-01T12:00:00+00:00'
+        mock_supabase_client.rpc.side_effect = httpx.ReadTimeout("timed out")
+        mock_fetch.return_value = [
+            {'id': 'DEP_1', 'type': 'DEPOSIT', 'amount': 500.0,
+             'timestamp': '2025-07-02T10:00:00+00:00', 'status': 'SUCCESS'},
+            {'id': 'WD_2', 'type': 'WITHDRAWAL', 'amount': 500.0,
+             'timestamp': '2025-07-02T11:00:00+00:00', 'status': 'SUCCESS'}
+        ]
+        logger = Mock()
+        
+        result = process_deposits_withdrawals(
+            mock_supabase_client, mock_binance_client, 1, benchmark_config, sample_prices, logger
+        )
+        
+        assert result == benchmark_config
+        mock_supabase_client.table().upsert.assert_not_called()
+        mock_update_time.assert_not_called()
+        assert 'process_error' in [c[0][1] for c in logger.error.call_args_list]
+    
+    @patch('api.index.update_last_processed_time')
+    @patch('api.index.get_last_processed_time')
+    @patch('api.index.fetch_new_transactions')
+    def test_process_zero_net_flow_uses_rpc(self, mock_fetch, mock_get_time, mock_update_time,
+                                            mock_supabase_client, mock_binance_client,
+                                            benchmark_config, sample_prices):
+        """Test that transactions and processing status are saved with one RPC call."""
+        mock_get_time.return_value = '2025-07-01T12:00:00+00:00'
+        mock_fetch.return_value = [
+            {'id': 'DEP_1', 'type': 'DEPOSIT', 'amount': 500.0,
+             'timestamp': '2025-07-02T10:00:00+00:00', 'status': 'SUCCESS'},
+            {'id': 'WD_2', 'type': 'WITHDRAWAL', 'amount': 500.0,
+             'timestamp': '2025-07-02T11:00:00+00:00', 'status': 'SUCCESS'}
+        ]
+        
+        process_deposits_withdrawals(
+            mock_supabase_client, mock_binance_client, 1, benchmark_config, sample_prices
+        )
+        
+        mock_supabase_client.rpc.assert_called_once()
+        rpc_name, params = mock_supabase_client.rpc.call_args[0]
+        assert rpc_name == 'save_processed_transactions'
+        assert params['p_account_id'] == '1'
+        assert [row['transaction_id'] for row in params['p_txns']] == ['DEP_1', 'WD_2']
+        mock_supabase_client.table().upsert.assert_not_called()
+        mock_update_time.assert_not_called()
+    
+    @patch('api.index.adjust_benchmark_for_cashflow')
+    @patch('api.index.get_last_processed_time')
+    @patch('api.index.fetch_new_transactions')
+    def test_process_sub_cent_net_flow_skips_adjustment(self, mock_fetch, mock_get_time, mock_adjust,
+                                                        mock_supabase_client, mock_binance_client,
+                                                        benchmark_config, sample_prices):
+        """Test that a float remainder from offsetting transactions is not treated as cashflow."""
+        mock_get_time.return_value = '2025-07-01T12:00:00+00:00'
+        mock_fetch.return_value = [
+            {'id': 'DEP_1', 'type': 'DEPOSIT', 'amount': 0.3,
+             'timestamp': '2025-07-02T10:00:00+00:00', 'status': 'SUCCESS'},
+            {'id': 'WD_2', 'type': 'WITHDRAWAL', 'amount': 0.1,
+             'timestamp': '2025-07-02T11:00:00+00:00', 'status': 'SUCCESS'},
+            {'id': 'WD_3', 'type': 'WITHDRAWAL', 'amount': 0.2,
+             'timestamp': '2025-07-02T12:00:00+00:00', 'status': 'SUCCESS'}
+        ]
+        
+        result = process_deposits_withdrawals(
+            mock_supabase_client, mock_binance_client, 1, benchmark_config, sample_prices
+        )
+        
+        assert result == benchmark_config
+        mock_adjust.assert_not_called()
+        rpc_name, params = mock_supabase_client.rpc.call_args[0]
+        assert rpc_name == 'save_processed_transactions'
+        assert len(params['p_txns']) == 3
+    
+    @patch('api.index.get_last_processed_time')
+    @patch('api.index.fetch_new_transactions')
+    def test_process_skips_fetch_when_recently_processed(self, mock_fetch, mock_get_time,
+                                                         mock_supabase_client, mock_binance_client,
+                                                         benchmark_config, sample_prices):
+        """Test that no Binance calls are made right after the last processing."""
+        mock_get_time.return_value = datetime.now(UTC).isoformat()
+        
+        result = process_deposits_withdrawals(
+            mock_supabase_client, mock_binance_client, 1, benchmark_config, sample_prices
+        )
+        
+        assert result == benchmark_config
+        mock_fetch.assert_not_called()
+    
+    @patch('api.index.get_last_processed_time')
+    @patch('api.index.fetch_new_transactions')
+    def test_process_fetches_on_next_scheduled_tick(self, mock_fetch, mock_get_time,
+                                                    mock_supabase_client, mock_binance_client,
+                                                    benchmark_config, sample_prices):
+        """Test that a tick one daemon interval (30 s) after the previous one still fetches."""
+        mock_get_time.return_value = (datetime.now(UTC) - timedelta(seconds=30)).isoformat()
+        mock_fetch.return_value = []
+        
+        process_deposits_withdrawals(
+            mock_supabase_client, mock_binance_client, 1, benchmark_config, sample_prices
+        )
+        
+        mock_fetch.assert_called_once()
+    
     @patch('api.index.get_last_processed_time')
     @patch('api.index.fetch_new_transactions')
     def test_process_api_error_graceful_fallback(self, mock_fetch, mock_get_time,
@@ -292,5 +922,62 @@ class TestProcessDepositsWithdrawals:
         assert result == benchmark_config
 
 
+class TestSaveHistory:
+    """Test nav_history writes."""
+    
+    def test_save_history_with_pending_rows_defers_insert(self, mock_supabase_client, sample_prices):
+        """Test that save_history appends the row instead of inserting it."""
+        pending_rows = []
+        
+        save_history(mock_supabase_client, 1, 10500.0, 10000.0, prices=sample_prices,
+                     pending_rows=pending_rows)
+        
+        mock_supabase_client.table().insert.assert_not_called()
+        assert len(pending_rows) == 1
+        assert pending_rows[0]['account_id'] == '1'
+        assert pending_rows[0]['nav'] == 10500.0
+        assert pending_rows[0]['btc_price'] == 65000.0
+    
+    def test_save_history_uses_tick_timestamp(self, mock_supabase_client, sample_prices):
+        """Test that rows from one tick share the passed timestamp."""
+        tick_ts = datetime(2025, 7, 2, 10, 0, 0, tzinfo=UTC)
+        pending_rows = []
+        
+        save_history(mock_supabase_client, 1, 10500.0, 10000.0, prices=sample_prices,
+                     pending_rows=pending_rows, timestamp=tick_ts)
+        save_history(mock_supabase_client, 2, 9500.0, 10000.0, prices=sample_prices,
+                     pending_rows=pending_rows, timestamp=tick_ts)
+        
+        assert pending_rows[0]['timestamp'] == pending_rows[1]['timestamp'] == tick_ts.isoformat()
+    
+    def test_save_nav_history_rows_single_insert(self, mock_supabase_client):
+        """Test that rows for all accounts go out in one insert call."""
+        rows = [{'account_id': '1', 'nav': 1.0}, {'account_id': '2', 'nav': 2.0}]
+        
+        save_nav_history_rows(mock_supabase_client, rows)
+        
+        mock_supabase_client.table.assert_called_with('nav_history')
+        mock_supabase_client.table().insert.assert_called_once_with(rows)
+    
+    def test_save_nav_history_rows_rejected_batch_retries_rows(self, mock_supabase_client):
+        """Test that one rejected account does not drop the other accounts' NAV points."""
+        rows = [{'account_id': '1', 'nav': 1.0}, {'account_id': '2', 'nav': None}]
+        rejected = APIError({'code': '23502', 'message': 'null value in column "nav"'})
+        insert = mock_supabase_client.table().insert
+        insert.return_value.execute.side_effect = [rejected, Mock(data=[]), rejected]
+        logger = Mock()
+        
+        save_nav_history_rows(mock_supabase_client, rows, logger)
+        
+        assert [c[0][0] for c in insert.call_args_list] == [rows, [rows[0]], [rows[1]]]
+        assert [c[1]['account_id'] for c in logger.error.call_args_list] == ['2']
+    
+    def test_save_nav_history_rows_empty(self, mock_supabase_client):
+        """Test that nothing is sent when there are no rows."""
+        save_nav_history_rows(mock_supabase_client, [])
+        
+        mock_supabase_client.table.assert_not_called()
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -5,16 +5,26 @@ import pytest
 from unittest.mock import Mock, patch
 from datetime import datetime, timedelta, UTC
 
+import httpx
+from postgrest import APIError
+
 # Import functions from our API
 from api.index import (
     calculate_benchmark_value,
     initialize_benchmark,
     rebalance_benchmark,
     calculate_next_rebalance_time,
-    adjust_benchmark_for_cashflow
+    adjust_benchmark_for_cashflow,
+    flush_benchmark_config_updates,
+    save_rebalance_history
 )
 
 
+def missing_rpc_error(name):
+    """PostgREST error for an RPC whose migration has not been applied."""
+    return APIError({'code': 'PGRST202', 'message': f'Could not find the function public.{name}'})
+
+
 class TestCalculateBenchmarkValue:
     """Test the calculate_benchmark_value function."""
     
@@ -148,6 +158,120 @@ class TestCalculateNextRebalanceTime:
         expected = datetime(2025, 7, 7, 12, 0, 0, tzinfo=UTC)
         assert result.replace(tzinfo=UTC) == expected
 
+    def test_calculate_next_rebalance_cached_within_hour(self):
+        """Test that calls within the same hour reuse the cached result."""
+        first = calculate_next_rebalance_time(datetime(2025, 7, 2, 10, 5, 0, tzinfo=UTC), 0, 12)
+        second = calculate_next_rebalance_time(datetime(2025, 7, 2, 10, 55, 0, tzinfo=UTC), 0, 12)
+
+        assert first is second
+        assert first == datetime(2025, 7, 7, 12, 0, 0)
+
+
+class TestDeferredRebalance:
+    """Test batched benchmark_configs writes for rebalancing."""
+    
+    def test_rebalance_with_pending_updates_defers_write(self, mock_supabase_client, sample_prices):
+        """Test that rebalance appends the config update instead of writing it."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'rebalance_day': 0,
+            'rebalance_hour': 12,
+            'rebalance_count': 2
+        }
+        pending_updates = []
+        
+        result = rebalance_benchmark(mock_supabase_client, config, 1, 10000.0, sample_prices,
+                                     pending_updates=pending_updates)
+        
+        mock_supabase_client.table().update.assert_not_called()
+        assert len(pending_updates) == 1
+        assert pending_updates[0]['account_id'] == 1
+        assert pending_updates[0]['rebalance_count'] == 3
+        
+        # Returned config reflects the new units without a DB round-trip
+        assert abs(result['btc_units'] - 5000.0 / 65000.0) < 0.000001
+        assert abs(result['eth_units'] - 5000.0 / 3500.0) < 0.000001
+        assert result['rebalance_day'] == 0
+    
+    def test_flush_benchmark_config_updates_single_upsert(self, mock_supabase_client):
+        """Test that pending updates are flushed in one upsert call."""
+        rows = [{'account_id': 1, 'btc_units': 0.1}, {'account_id': 2, 'btc_units': 0.2}]
+        
+        flush_benchmark_config_updates(mock_supabase_client, rows)
+        
+        mock_supabase_client.table().upsert.assert_called_once_with(rows, on_conflict='account_id')
+    
+    def test_flush_benchmark_config_updates_empty(self, mock_supabase_client):
+        """Test that nothing is written when there are no pending updates."""
+        assert flush_benchmark_config_updates(mock_supabase_client, []) == set()
+        
+        mock_supabase_client.table.assert_not_called()
+    
+    def test_flush_rejected_batch_retries_each_account(self, mock_supabase_client):
+        """Test that one rejected row only fails its own account."""
+        rows = [{'account_id': 1, 'btc_units': 0.1}, {'account_id': 2, 'btc_units': None}]
+        rejected = APIError({'code': '23502', 'message': 'null value in column "btc_units"'})
+        upsert = mock_supabase_client.table().upsert
+        upsert.return_value.execute.side_effect = [rejected, Mock(data=[]), rejected]
+        logger = Mock()
+        
+        saved = flush_benchmark_config_updates(mock_supabase_client, rows, logger)
+        
+        assert saved == {1}
+        assert [c[0][0] for c in upsert.call_args_list] == [rows, [rows[0]], [rows[1]]]
+        assert logger.error.call_args[1]['account_id'] == 2
+    
+    def test_flush_transport_error_saves_nothing(self, mock_supabase_client):
+        """Test that an unknown outcome is not retried row by row and no account counts as saved."""
+        rows = [{'account_id': 1, 'btc_units': 0.1}]
+        mock_supabase_client.table().upsert.return_value.execute.side_effect = httpx.ReadTimeout("timed out")
+        
+        assert flush_benchmark_config_updates(mock_supabase_client, rows) == set()
+        mock_supabase_client.table().upsert.assert_called_once()
+    
+    def test_rebalance_with_pending_history_defers_insert(self, mock_supabase_client, sample_prices):
+        """Test that rebalance history rows are collected instead of inserted."""
+        config = {'btc_units': 0.1, 'eth_units': 1.0, 'rebalance_day': 0, 'rebalance_hour': 12}
+        pending_history = []
+        
+        rebalance_benchmark(mock_supabase_client, config, 1, 10000.0, sample_prices,
+                            pending_updates=[], pending_history=pending_history)
+        
+        mock_supabase_client.table().insert.assert_not_called()
+        assert len(pending_history) == 1
+        assert pending_history[0]['account_id'] == 1
+        assert pending_history[0]['status'] == 'success'
+    
+    def test_save_rebalance_history_single_insert(self, mock_supabase_client):
+        """Test that history rows for all accounts are inserted in one call."""
+        rows = [{'account_id': 1}, {'account_id': 2}]
+        
+        save_rebalance_history(mock_supabase_client, rows)
+        
+        mock_supabase_client.table.assert_called_with('benchmark_rebalance_history')
+        mock_supabase_client.table().insert.assert_called_once_with(rows)
+    
+    def test_save_rebalance_history_rejected_row_keeps_others(self, mock_supabase_client):
+        """Test that a rejected batch is retried per row so other accounts keep their record."""
+        rows = [{'account_id': 1}, {'account_id': 2}]
+        rejected = APIError({'code': '23514', 'message': 'check constraint violated'})
+        mock_supabase_client.table().insert.return_value.execute.side_effect = [rejected, rejected, Mock(data=[])]
+        logger = Mock()
+        
+        save_rebalance_history(mock_supabase_client, rows, logger)
+        
+        saved = [c[1]['account_id'] for c in logger.info.call_args_list]
+        failed = [c[1]['account_id'] for c in logger.error.call_args_list]
+        assert (saved, failed) == ([2], [1])
+    
+    def test_save_rebalance_history_unexpected_error_raises(self, mock_supabase_client):
+        """Test that only database write errors are swallowed."""
+        mock_supabase_client.table().insert.return_value.execute.side_effect = KeyError('account_id')
+        
+        with pytest.raises(KeyError):
+            save_rebalance_history(mock_supabase_client, [{'account_id': 1}])
+
 
 class TestAdjustBenchmarkForCashflow:
     """Test the adjust_benchmark_for_cashflow function."""
@@ -237,6 +361,182 @@ class TestAdjustBenchmarkForCashflow:
         assert result['btc_units'] == 0.1
         assert result['eth_units'] == 1.0
 
+    
+    def test_adjust_benchmark_withdrawal_initialized(self, mock_supabase_client, sample_prices):
+        """Test proportional withdrawal scaling on an initialized benchmark."""
+        config = {
+            'btc_units': 0.1,      # Worth $6500
+            'eth_units': 1.0,      # Worth $3500
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        mock_supabase_client.table().execute.return_value = Mock(data=[{'id': 1}])
+        
+        result = adjust_benchmark_for_cashflow(
+            mock_supabase_client, config, 1, -2500.0, sample_prices, []
+        )
+        
+        # $2500 of $10000 withdrawn -> both legs scaled by 0.75
+        assert abs(result['btc_units'] - 0.075) < 0.000001
+        assert abs(result['eth_units'] - 0.75) < 0.000001
+
+    def test_adjust_benchmark_single_config_update(self, mock_supabase_client, sample_prices):
+        """Without the RPC, units and last modification info go out in one benchmark_configs update."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        mock_supabase_client.table().execute.return_value = Mock(data=[{'id': 42}])
+        mock_supabase_client.rpc.side_effect = missing_rpc_error("atomic_cashflow_update")
+
+        adjust_benchmark_for_cashflow(
+            mock_supabase_client, config, 1, 1000.0, sample_prices, []
+        )
+
+        mock_table = mock_supabase_client.table()
+        assert mock_table.update.call_count == 1
+        update_data = mock_table.update.call_args[0][0]
+        assert mock_table.update.call_args[1] == {'count': 'exact', 'returning': 'minimal'}
+        assert update_data['last_modification_id'] == 42
+        assert update_data['last_modification_type'] == 'deposit'
+        assert abs(update_data['btc_units'] - (0.1 + 500.0 / 65000.0)) < 0.000001
+
+    def test_adjust_benchmark_uses_atomic_rpc(self, mock_supabase_client, sample_prices):
+        """All cashflow writes go through a single atomic_cashflow_update RPC call."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        processed_txns = [{'account_id': 1, 'transaction_id': 'DEP_1', 'type': 'DEPOSIT', 'amount': 1000.0}]
+        mock_supabase_client.rpc.return_value.execute.return_value = Mock(data=7)
+
+        result = adjust_benchmark_for_cashflow(
+            mock_supabase_client, config, 1, 1000.0, sample_prices, processed_txns
+        )
+
+        mock_supabase_client.rpc.assert_called_once()
+        rpc_name, params = mock_supabase_client.rpc.call_args[0]
+        assert rpc_name == 'atomic_cashflow_update'
+        assert params['p_account_id'] == '1'
+        assert params['p_txns'] == processed_txns
+        assert params['p_modification']['modification_type'] == 'deposit'
+        assert abs(params['p_btc_units'] - result['btc_units']) < 0.000001
+        assert abs(params['p_modification']['btc_units_bought'] - 500.0 / 65000.0) < 0.000001
+        assert abs(params['p_modification']['eth_units_bought'] - 500.0 / 3500.0) < 0.000001
+        mock_supabase_client.table.assert_not_called()
+
+
+    def test_adjust_benchmark_missing_config_row_raises(self, mock_supabase_client, sample_prices):
+        """A fallback update that affects no benchmark_configs row aborts before last_processed is updated."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        # processed_transactions upsert, benchmark_modifications insert, benchmark_configs update
+        mock_supabase_client.table().execute.side_effect = [
+            Mock(data=[], count=1), Mock(data=[]), Mock(data=[], count=0)
+        ]
+        mock_supabase_client.rpc.side_effect = missing_rpc_error("atomic_cashflow_update")
+
+        with patch('api.index.update_last_processed_time') as mock_update_time:
+            with pytest.raises(Exception, match="no rows affected"):
+                adjust_benchmark_for_cashflow(
+                    mock_supabase_client, config, 1, 1000.0, sample_prices,
+                    [{'account_id': '1', 'transaction_id': 'DEP_1', 'type': 'DEPOSIT'}]
+                )
+
+        mock_update_time.assert_not_called()
+        assert config['btc_units'] == 0.1
+
+    def test_adjust_benchmark_db_error_context_logged(self, mock_supabase_client, sample_prices):
+        """A failed DB write logs the atomic and validation context before re-raising."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        mock_supabase_client.table().execute.return_value = Mock(data=[], count=0)
+        mock_supabase_client.rpc.side_effect = missing_rpc_error("atomic_cashflow_update")
+        logger = Mock()
+
+        with pytest.raises(Exception, match="no rows affected"):
+            adjust_benchmark_for_cashflow(mock_supabase_client, config, 1, 1000.0, sample_prices, [], logger)
+
+        errors = {c[0][1]: c[1]['data'] for c in logger.error.call_args_list}
+        assert errors['atomic_cashflow_update']['db_error_type'] == 'Exception'
+        assert errors['adjust_benchmark_error']['stage'] == 'database_update'
+        assert errors['adjust_benchmark_error']['net_flow'] == 1000.0
+
+    @pytest.mark.parametrize("rpc_error", [
+        APIError({'code': '23505', 'message': 'duplicate key value violates unique constraint'}),
+        httpx.ReadTimeout("timed out"),
+    ])
+    def test_adjust_benchmark_rpc_error_does_not_fall_back(self, mock_supabase_client, sample_prices, rpc_error):
+        """Errors other than a missing function are raised instead of repeating the writes non-atomically."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        mock_supabase_client.rpc.side_effect = rpc_error
+
+        with pytest.raises(type(rpc_error)):
+            adjust_benchmark_for_cashflow(
+                mock_supabase_client, config, 1, 1000.0, sample_prices,
+                [{'account_id': '1', 'transaction_id': 'DEP_1', 'type': 'DEPOSIT'}]
+            )
+
+        mock_supabase_client.table.assert_not_called()
+        assert config['btc_units'] == 0.1
+
+    def test_adjust_benchmark_missing_rpc_fallback_warns(self, mock_supabase_client, sample_prices):
+        """A missing atomic_cashflow_update is reported at warning level before the fallback."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        mock_supabase_client.table().execute.return_value = Mock(data=[], count=1)
+        mock_supabase_client.rpc.side_effect = missing_rpc_error("atomic_cashflow_update")
+        logger = Mock()
+
+        adjust_benchmark_for_cashflow(mock_supabase_client, config, 1, 1000.0, sample_prices, [], logger)
+
+        warnings = [c[0][1] for c in logger.warning.call_args_list]
+        assert 'atomic_cashflow_update_rpc_fallback' in warnings
+
+    def test_adjust_benchmark_duplicates_abort_before_config_update(self, mock_supabase_client, sample_prices):
+        """Already processed transactions (from the inserted row count) stop the fallback before the benchmark changes."""
+        config = {
+            'btc_units': 0.1,
+            'eth_units': 1.0,
+            'initialized_at': '2025-07-01T00:00:00+00:00'
+        }
+        processed_txns = [
+            {'account_id': '1', 'transaction_id': 'DEP_1', 'type': 'DEPOSIT'},
+            {'account_id': '1', 'transaction_id': 'DEP_2', 'type': 'DEPOSIT'}
+        ]
+        mock_supabase_client.table().execute.return_value = Mock(data=[], count=1)
+        mock_supabase_client.rpc.side_effect = missing_rpc_error("atomic_cashflow_update")
+        logger = Mock()
+
+        with pytest.raises(Exception, match="already processed"):
+            adjust_benchmark_for_cashflow(
+                mock_supabase_client, config, 1, 1000.0, sample_prices, processed_txns, logger
+            )
+
+        upsert_kwargs = mock_supabase_client.table().upsert.call_args_list[0][1]
+        assert upsert_kwargs['returning'] == 'minimal'
+        assert upsert_kwargs['count'] == 'exact'
+        mock_supabase_client.table().update.assert_not_called()
+        mock_supabase_client.table().insert.assert_not_called()
+        assert config['btc_units'] == 0.1
+        errors = [c for c in logger.error.call_args_list if c[0][1] == 'duplicate_in_atomic_update']
+        assert len(errors) == 1
+        assert '1 of 2 ' in errors[0][0][2]
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Unit tests for the monitor's Binance client wrapper (api/binance_client.py).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from unittest.mock import Mock, patch
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+from api import binance_client
+from api.binance_client import MonitorBinanceClient, HttpxSession
+
+
+def make_response(status_code, content):
+    response = Mock()
+    response.status_code = status_code
+    response.content = content
+    response.text = content.decode('utf-8')
+    return response
+
+
+class TestHandleResponse:
+    """Test MonitorBinanceClient._handle_response parsing."""
+
+    def test_parses_json_body(self):
+        """Test that a successful response body is decoded."""
+        response = make_response(200, b'{"symbol": "BTCUSDT", "price": "65000.00"}')
+
+        result = MonitorBinanceClient._handle_response(response)
+
+        assert result == {'symbol': 'BTCUSDT', 'price': '65000.00'}
+
+    def test_empty_body_returns_empty_dict(self):
+        """Test that an empty body is returned as an empty dict."""
+        assert MonitorBinanceClient._handle_response(make_response(200, b'')) == {}
+
+    def test_error_status_raises_api_exception(self):
+        """Test that non-2xx responses raise BinanceAPIException."""
+        response = make_response(400, b'{"code": -1121, "msg": "Invalid symbol."}')
+
+        with pytest.raises(BinanceAPIException):
+            MonitorBinanceClient._handle_response(response)
+
+    def test_invalid_json_raises_request_exception(self):
+        """Test that a malformed body raises BinanceRequestException."""
+        with pytest.raises(BinanceRequestException):
+            MonitorBinanceClient._handle_response(make_response(200, b'<html>'))
+
+
+class TestHttpxSession:
+    """Test the requests-compatible httpx session facade."""
+
+    def make_session(self, handler):
+        session = HttpxSession(headers={'X-MBX-APIKEY': 'key'})
+        session._client = httpx.Client(transport=httpx.MockTransport(handler), headers=session.headers)
+        return session
+
+    def test_get_passes_query_string_and_headers(self):
+        """Test that python-binance style GET arguments reach the wire unchanged."""
+        seen = {}
+
+        def handler(request):
+            seen['url'] = str(request.url)
+            seen['api_key'] = request.headers.get('X-MBX-APIKEY')
+            return httpx.Response(200, content=b'{"price": "1.0"}')
+
+        session = self.make_session(handler)
+        response = session.get('https://api.binance.com/api/v3/ticker/price',
+                               headers={}, data=None, params='symbol=BTCUSDT', timeout=10)
+
+        assert seen['url'] == 'https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT'
+        assert seen['api_key'] == 'key'
+        assert MonitorBinanceClient._handle_response(response) == {'price': '1.0'}
+
+    def test_signed_query_string_sent_verbatim(self):
+        """Test that a pre-signed query with reserved characters is not re-encoded."""
+        seen = {}
+
+        def handler(request):
+            seen['query'] = request.url.query
+            return httpx.Response(200, content=b'{}')
+
+        session = self.make_session(handler)
+        query = 'email=sub@example.com&startTime=1751371200000&timestamp=1751450400000&signature=abc123'
+        session.get('https://api.binance.com/sapi/v1/sub-account/transfer/subUserHistory',
+                    headers={}, data=None, params=query, timeout=10)
+
+        assert seen['query'] == query.encode()
+
+    def test_post_encodes_form_tuples(self):
+        """Test that list-of-tuples form data is url-encoded into the body."""
+        seen = {}
+
+        def handler(request):
+            seen['body'] = request.content
+            return httpx.Response(200, content=b'{}')
+
+        session = self.make_session(handler)
+        session.post('https://api.binance.com/sapi/v1/test',
+                     headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                     data=[('asset', 'BTC'), ('signature', 'abc')], timeout=10)
+
+        assert seen['body'] == b'asset=BTC&signature=abc'
+
+    def test_connect_timeout_is_capped(self):
+        """Test that connecting gets a shorter budget than the overall request timeout."""
+        seen = {}
+
+        def handler(request):
+            seen['timeout'] = request.extensions['timeout']
+            return httpx.Response(200, content=b'{}')
+
+        session = self.make_session(handler)
+        session.get('https://api.binance.com/api/v3/time', headers={}, timeout=10)
+
+        assert seen['timeout']['connect'] == binance_client.CONNECT_TIMEOUT_SECONDS
+        assert seen['timeout']['read'] == 10
+
+    def test_sessions_share_pool_but_not_api_keys(self):
+        """Test that clients reuse one connection pool while keeping their own headers."""
+        seen = []
+
+        def handler(request):
+            seen.append(request.headers.get('X-MBX-APIKEY'))
+            return httpx.Response(200, content=b'{}')
+
+        shared = httpx.Client(transport=httpx.MockTransport(handler))
+        with patch.object(binance_client, '_shared_client', shared):
+            first = HttpxSession(headers={'X-MBX-APIKEY': 'first'})
+            second = HttpxSession(headers={'X-MBX-APIKEY': 'second'})
+            first.get('https://api.binance.com/api/v3/account', headers={})
+            second.get('https://api.binance.com/api/v3/account', headers={})
+            first.close()
+
+            assert first._client is None
+            assert second._client is shared
+            assert not shared.is_closed
+
+        assert seen == ['first', 'second']
+
+
+class TestRequestLimit:
+    """Test the shared cap on in-flight Binance requests."""
+
+    def test_request_holds_slot_while_in_flight(self):
+        """Test that a request occupies one slot and releases it afterwards."""
+        client = MonitorBinanceClient('key', 'secret', ping=False)
+        slots = binance_client._request_slots
+        seen = {}
+
+        def fake_get(uri, headers=None, data=None, **kwargs):
+            seen['free_slots'] = slots._value
+            return make_response(200, b'{"ok": true}')
+
+        client.session = Mock(get=fake_get)
+        free_before = slots._value
+        result = client._request('get', 'https://api.binance.com/api/v3/time', False)
+
+        assert result == {'ok': True}
+        assert seen['free_slots'] == free_before - 1
+        assert slots._value == free_before
+
+    def test_installed_python_binance_matches_copied_request(self):
+        """Test that python-binance is the version MonitorBinanceClient._request was copied from."""
+        import binance
+
+        # Upgrading requires re-syncing _request with the new Client._request first
+        assert binance.__version__ == '1.0.37'
+
+
+class TestConcurrentRequests:
+    """Test that one client can be shared by several threads."""
+
+    def test_overlapping_requests_parse_their_own_response(self):
+        """Test that each call returns its own body even when another response is stored in between."""
+        both_stored = threading.Barrier(2)
+
+        class RacingClient(MonitorBinanceClient):
+            # Both threads store their response before either continues - the worst interleaving
+            def _set_response(self, response):
+                self._last_response = response
+                if response is not None:
+                    both_stored.wait(timeout=5)
+
+            response = property(lambda self: self._last_response, _set_response)
+
+        client = RacingClient('key', 'secret', ping=False)
+        client.session = Mock(get=lambda uri, **kwargs: make_response(200, ('{"uri": "%s"}' % uri).encode()))
+        uris = ['https://api.binance.com/sapi/v1/capital/deposit/hisrec',
+                'https://api.binance.com/sapi/v1/capital/withdraw/history']
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(lambda uri: client._request('get', uri, False), uris))
+
+        assert [result['uri'] for result in results] == uris
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,43 @@
+"""
+Unit tests for the shared Supabase client setup.
+"""
+import httpx
+import pytest
+from supabase import create_client
+
+from utils.database_manager import use_orjson_for_postgrest
+
+
+class TestOrjsonPostgrest:
+    """Test orjson encoding of PostgREST request bodies."""
+
+    @pytest.fixture
+    def captured(self):
+        return {}
+
+    @pytest.fixture
+    def client(self, captured):
+        def handler(request):
+            captured['body'] = request.content
+            captured['headers'] = request.headers
+            return httpx.Response(201, json=[{'id': 1}])
+
+        client = create_client('https://example.supabase.co', 'test_key')
+        client.postgrest.session._transport = httpx.MockTransport(handler)
+        use_orjson_for_postgrest(client)
+        return client
+
+    def test_insert_body_encoded_with_orjson(self, client, captured):
+        """Test that rows are sent as compact JSON with the PostgREST headers intact."""
+        result = client.table('nav_history').insert([{'nav': 10500.5, 'account_id': 'a', 'note': None}]).execute()
+
+        assert result.data == [{'id': 1}]
+        assert captured['body'] == b'[{"nav":10500.5,"account_id":"a","note":null}]'
+        assert captured['headers']['content-type'] == 'application/json'
+        assert captured['headers']['prefer'] == 'return=representation'
+
+    def test_get_request_has_no_body(self, client, captured):
+        """Test that reads are passed through unchanged."""
+        client.table('nav_history').select('*').eq('account_id', 'a').execute()
+
+        assert captured['body'] == b''
@@ -11,6 +11,15 @@ from api.index import handler, process_all_accounts
 from api.logger import LogCategory
 
 
+def make_request_handler(path='/api/index'):
+    """Mock request handler that runs the real handler._send_text against mocked send_* calls."""
+    mock_request_handler = Mock(spec=handler)
+    mock_request_handler.path = path
+    mock_request_handler.wfile = BytesIO() # Simulate wfile as a byte stream
+    mock_request_handler._send_text.side_effect = lambda *args: handler._send_text(mock_request_handler, *args)
+    return mock_request_handler
+
+
 class TestVercelHandler:
     """Test the Vercel handler class (api/index.py)."""
 
@@ -23,8 +32,7 @@ class TestVercelHandler:
         mock_get_logger.return_value = mock_logger
 
         # Mock the BaseHTTPRequestHandler methods
-        mock_request_handler = Mock(spec=BaseHTTPRequestHandler)
-        mock_request_handler.wfile = BytesIO() # Simulate wfile as a byte stream
+        mock_request_handler = make_request_handler()
 
         # Act
         handler.do_GET(mock_request_handler)
@@ -40,8 +48,36 @@ class TestVercelHandler:
         mock_request_handler.send_response.assert_called_once_with(200)
         mock_request_handler.send_header.assert_any_call('Content-type','text/plain')
         mock_request_handler.end_headers.assert_called_once()
+        mock_request_handler.send_header.assert_any_call('Content-Length', str(len(b'Monitoring process completed successfully.')))
         assert mock_request_handler.wfile.getvalue() == b'Monitoring process completed successfully.'
 
+    @patch('api.index.warm_connections')
+    @patch('api.index.process_all_accounts')
+    def test_do_get_warm_skips_monitoring(self, mock_process_all_accounts, mock_warm_connections):
+        """Test that the keep-warm ping opens connections without running a monitoring cycle."""
+        mock_request_handler = make_request_handler('/api/index?warm=1')
+
+        with patch('api.index.supabase', Mock()):
+            handler.do_GET(mock_request_handler)
+
+        mock_warm_connections.assert_called_once()
+        mock_process_all_accounts.assert_not_called()
+        mock_request_handler.send_response.assert_called_once_with(200)
+        assert mock_request_handler.wfile.getvalue() == b'Warm.'
+
+    @patch('api.index.process_all_accounts')
+    def test_do_head_skips_monitoring(self, mock_process_all_accounts):
+        """Test that HEAD answers without running a monitoring cycle or writing a body."""
+        mock_request_handler = make_request_handler()
+
+        with patch('api.index.supabase', Mock()):
+            handler.do_HEAD(mock_request_handler)
+
+        mock_process_all_accounts.assert_not_called()
+        mock_request_handler.send_response.assert_called_once_with(200)
+        mock_request_handler.send_header.assert_any_call('Content-Length', '0')
+        assert mock_request_handler.wfile.getvalue() == b''
+
     @patch('api.index.get_logger')
     @patch('api.index.process_all_accounts')
     @patch('api.index.traceback.print_exc')
@@ -55,8 +91,7 @@ class TestVercelHandler:
         mock_process_all_accounts.side_effect = Exception(error_message)
 
         # Mock the BaseHTTPRequestHandler methods
-        mock_request_handler = Mock(spec=BaseHTTPRequestHandler)
-        mock_request_handler.wfile = BytesIO() # Simulate wfile as a byte stream
+        mock_request_handler = make_request_handler()
 
         # Act
         handler.do_GET(mock_request_handler)
@@ -0,0 +1,93 @@
+"""
+Unit tests for the structured monitor logger.
+"""
+import json
+import logging
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from api.logger import MonitorLogger, LogCategory, LogLevel
+
+
+@pytest.fixture
+def monitor_logger(tmp_path, monkeypatch):
+    """MonitorLogger writing into a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    monitor_logger = MonitorLogger(log_file="test_logs.jsonl")
+    monkeypatch.setattr(monitor_logger, '_should_use_database_logging', lambda: False)
+    return monitor_logger
+
+
+class TestLogLevelGating:
+    """Test level-based filtering of log entries."""
+    
+    def test_is_enabled_respects_min_level(self, monitor_logger):
+        """Test that levels below the configured minimum are disabled."""
+        monitor_logger.min_level = logging.INFO
+        
+        assert not monitor_logger.is_enabled(LogLevel.DEBUG)
+        assert monitor_logger.is_enabled(LogLevel.INFO)
+        assert monitor_logger.is_enabled(LogLevel.ERROR)
+    
+    def test_disabled_level_not_recorded(self, monitor_logger):
+        """Test that debug entries are dropped when the minimum level is INFO."""
+        monitor_logger.min_level = logging.INFO
+        before = len(monitor_logger.logs)
+        
+        monitor_logger.debug(LogCategory.SYSTEM, "debug_op", "Hidden")
+        monitor_logger.info(LogCategory.SYSTEM, "info_op", "Visible")
+        
+        recorded = [entry.operation for entry in monitor_logger.logs[before:]]
+        assert recorded == ["info_op"]
+
+
+class TestFileOutput:
+    """Test the JSON lines written to the log file."""
+    
+    def test_entry_round_trips_through_file(self, monitor_logger):
+        """Test that a logged entry (with non-string data keys) is written as one JSON line."""
+        monitor_logger.info(LogCategory.API_CALL, "nav", "NAV fetched", account_id=1,
+                            data={"spot_total": 1.5, 7: "int key"})
+        
+        lines = monitor_logger.file_path.read_text().splitlines()
+        written = json.loads(lines[-1])
+        
+        assert written["operation"] == "nav"
+        assert written["data"] == {"spot_total": 1.5, "7": "int key"}
+        assert written["success"] is True
+
+    
+    def test_concurrent_logging_keeps_every_entry(self, monitor_logger):
+        """Test that entries logged from several threads while trimming are neither lost nor duplicated."""
+        monitor_logger.max_entries = 50
+        monitor_logger.logs = []
+        
+        def log_many(thread_id):
+            for i in range(100):
+                monitor_logger.info(LogCategory.SYSTEM, f"op_{thread_id}_{i}", "Concurrent entry")
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(log_many, range(8)))
+        
+        assert len(monitor_logger.logs) == 50
+        written = [json.loads(line)["operation"] for line in monitor_logger.file_path.read_text().splitlines()]
+        assert len({op for op in written if op.startswith("op_")}) == 800
+
+
+class TestErrorLogs:
+    """Test get_error_logs time filtering."""
+    
+    def test_recent_errors_returned_newest_first(self, monitor_logger):
+        """Test that recent failed entries (including 'Z'-suffixed timestamps) are returned."""
+        monitor_logger.error(LogCategory.DATABASE, "first", "First failure")
+        monitor_logger.info(LogCategory.DATABASE, "ok", "Fine")
+        monitor_logger.error(LogCategory.DATABASE, "second", "Second failure")
+        monitor_logger.logs[-1].timestamp = monitor_logger.logs[-1].timestamp.replace('+00:00', 'Z')
+        
+        operations = [entry["operation"] for entry in monitor_logger.get_error_logs(hours=1)]
+        
+        assert operations[:2] == ["second", "first"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -6,8 +6,15 @@ import threading
 import time
 from typing import Optional, Dict, Any
 from functools import wraps
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 import os
+
+try:
+    import orjson
+except ImportError:
+    # Fallback to httpx's stdlib json encoding if orjson is not installed
+    orjson = None
 try:
     from config import settings
 except ImportError:
@@ -16,10 +23,32 @@ except ImportError:
         class Database:
             supabase_url = os.getenv('SUPABASE_URL', '')
             supabase_key = os.getenv('SUPABASE_ANON_KEY', '')
+            timeout_seconds = 10
     settings = Settings()
     settings.database = Settings.Database()
 
 
+def use_orjson_for_postgrest(client: Client) -> None:
+    """
+    Encode PostgREST request bodies with orjson instead of httpx's stdlib json.
+    postgrest-py passes row payloads as request(json=...); they are converted to content= here.
+    """
+    if orjson is None:
+        return
+    
+    session = client.postgrest.session
+    send = session.request
+    
+    def request(method, url, *, json=None, headers=None, **kwargs):
+        if json is not None:
+            headers = httpx.Headers(headers)
+            headers['Content-Type'] = 'application/json'
+            kwargs['content'] = orjson.dumps(json)
+        return send(method, url, headers=headers, **kwargs)
+    
+    session.request = request
+
+
 class DatabaseManager:
     """Singleton database manager for Supabase connections."""
     
@@ -53,10 +82,16 @@ class DatabaseManager:
                 # Use service role key if available for admin operations
                 supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY', self._config.database.supabase_key)
                 
+                # One client (and one HTTP/2 keep-alive pool) is shared by every caller in the process
                 self._client = create_client(
                     self._config.database.supabase_url,
-                    supabase_key
+                    supabase_key,
+                    options=ClientOptions(
+                        postgrest_client_timeout=self._config.database.timeout_seconds,
+                        schema='public'
+                    )
                 )
+                use_orjson_for_postgrest(self._client)
                 self._last_health_check = time.time()
                 return
             except Exception as e: